@@ -0,0 +1,117 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Add the root directory to the system path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import torch
+
+from config.config import Config
+from twitch.chat_context import ChatContext
+from twitch.chatter_bot import ChatMessageGenerator
+from utils.utils import iter_chat_records, load_json
+
+
+def chat_prompts(tokenizer, count, messages_between):
+    """Prompt token ids with windows of the recorded chat logs, as the bot builds them"""
+    context = ChatContext(tokenizer)
+    prompts = []
+    i = 0
+    for path in sorted(Path(Config.CHAT_LOGS_DIR).rglob('*.json*')):
+        for username, message in iter_chat_records(load_json(path)):
+            context.add(username, message, timestamp=i / 10)
+            i += 1
+            if i % messages_between == 0:
+                prompts.append(context.prompt_ids(now=i / 10))
+                if len(prompts) == count:
+                    return prompts
+    return prompts
+
+
+class ForwardCounter:
+    """Count a model's forward passes"""
+
+    def __init__(self, model):
+        self.count = 0
+        model.register_forward_pre_hook(self.hook)
+
+    def hook(self, module, args):
+        self.count += 1
+
+
+def run(generator, prompts, max_new_tokens, target, draft):
+    """Generate a message per prompt, returning seconds, tokens and forward passes"""
+    elapsed = tokens = target_forwards = draft_forwards = 0
+    for prompt_ids in prompts:
+        # Compute the prompt cache first so only generation is measured
+        generator.prompt_cache(torch.tensor([prompt_ids], device=generator.model.device))
+        target.count = draft.count = 0
+        before = generator.stats["tokens"]
+        torch.manual_seed(0)
+
+        start = time.perf_counter()
+        generator.generate(max_new_tokens=max_new_tokens, prompt_ids=prompt_ids)
+        elapsed += time.perf_counter() - start
+        tokens += generator.stats["tokens"] - before
+        target_forwards += target.count
+        draft_forwards += draft.count
+    return elapsed, tokens, target_forwards, draft_forwards
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure assisted generation with a draft model on prompts from the chat logs.")
+    parser.add_argument("--draft", default=Config.DRAFT_MODEL, help="Draft model to assist with.")
+    parser.add_argument("--lookahead", default="2,4,6,8", help="Comma separated draft tokens per step to try.")
+    parser.add_argument("--confidence", type=float, help="Draft token probability below which a step stops drafting.")
+    parser.add_argument("--prompts", type=int, default=10, help="Chat window prompts to generate for.")
+    parser.add_argument("--tokens", type=int, default=32, help="Maximum new tokens per message.")
+    parser.add_argument("--greedy", action="store_true", help="Decode greedily instead of sampling.")
+    args = parser.parse_args()
+    if not args.draft:
+        print("Set DRAFT_MODEL or pass --draft")
+        return
+
+    generator = ChatMessageGenerator(draft_model=args.draft)
+    draft_model = generator.draft_model
+    draft_model.generation_config.num_assistant_tokens_schedule = "constant"
+    if args.confidence is not None:
+        draft_model.generation_config.assistant_confidence_threshold = args.confidence
+    if args.greedy:
+        # The generator samples explicitly, so override it per call
+        sample_generate = generator.model.generate
+        generator.model.generate = lambda **kwargs: sample_generate(**{**kwargs, "do_sample": False})
+    prompts = chat_prompts(generator.tokenizer, args.prompts, messages_between=50)
+    if not prompts:
+        print(f"No chat logs found in {Config.CHAT_LOGS_DIR}")
+        return
+    target = ForwardCounter(generator.model)
+    draft = ForwardCounter(draft_model)
+
+    # Warm up both paths
+    generator.generate(max_new_tokens=4, prompt_ids=prompts[0])
+    generator.draft_model = None
+    generator.generate(max_new_tokens=4, prompt_ids=prompts[0])
+
+    baseline, tokens, _, _ = run(generator, prompts, args.tokens, target, draft)
+    print(f"{len(prompts)} prompts of about {sum(map(len, prompts)) // len(prompts)} tokens from the chat logs")
+    print(f"{'lookahead':>10}{'s/message':>11}{'tokens/s':>10}{'drafted/verify':>16}{'accepted':>10}"
+          f"{'tokens/verify':>15}{'speedup':>9}")
+    print(f"{'none':>10}{baseline / len(prompts):>11.2f}{tokens / baseline:>10.1f}{'':>26}{1:>15.2f}{1:>9.2f}")
+
+    generator.draft_model = draft_model
+    for lookahead in [int(value) for value in args.lookahead.split(",")]:
+        draft_model.generation_config.num_assistant_tokens = lookahead
+        elapsed, tokens, target_forwards, draft_forwards = run(generator, prompts, args.tokens, target, draft)
+
+        # Each verifying forward pass yields one token of its own plus the draft tokens it accepted
+        accepted = (tokens - target_forwards) / max(draft_forwards, 1)
+        print(f"{lookahead:>10}{elapsed / len(prompts):>11.2f}{tokens / elapsed:>10.1f}"
+              f"{draft_forwards / max(target_forwards, 1):>16.2f}{accepted:>10.1%}"
+              f"{tokens / max(target_forwards, 1):>15.2f}{baseline / elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
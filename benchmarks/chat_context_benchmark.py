@@ -0,0 +1,76 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+
+# Add the root directory to the system path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from transformers import AutoTokenizer
+
+from config.config import Config
+from twitch.chat_context import ChatContext
+from utils.dataset_formatter import clean_message
+from utils.utils import iter_chat_records, load_json
+
+
+def load_chat(limit):
+    """Read (username, message) pairs from the recorded chat logs"""
+    records = []
+    for path in sorted(Path(Config.CHAT_LOGS_DIR).rglob('*.json*')):
+        records.extend(iter_chat_records(load_json(path)))
+        if len(records) >= limit:
+            break
+    return records[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the cost of keeping a recent chat window and building prompts from it.")
+    parser.add_argument("--model", default=Config.MODEL_PATH, help="Model whose tokenizer to use.")
+    parser.add_argument("--messages", type=int, default=100000, help="Chat messages to replay.")
+    parser.add_argument("--prompt-every", type=int, default=100, help="Build a prompt every this many messages.")
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    records = load_chat(args.messages)
+    if not records:
+        print(f"No chat logs found in {Config.CHAT_LOGS_DIR}")
+        return
+
+    # Replay as fast as possible, one second of chat time per 100 messages
+    context = ChatContext(tokenizer)
+    lines = []
+    add_time = prompt_time = full_time = 0.0
+    prompts = identical = 0
+    for i, (username, message) in enumerate(records):
+        start = time.perf_counter()
+        context.add(username, message, timestamp=i / 100)
+        add_time += time.perf_counter() - start
+        if clean_message(message):
+            lines.append(f"{username}: {clean_message(message)}\n")
+
+        if i % args.prompt_every == 0 and len(context):
+            start = time.perf_counter()
+            ids = context.prompt_ids(now=i / 100)
+            prompt_time += time.perf_counter() - start
+
+            # The same window tokenized from scratch
+            text = context.PROMPT_PREFIX + "".join(lines[-len(context):]) + context.PROMPT_SUFFIX
+            start = time.perf_counter()
+            whole = tokenizer(text, add_special_tokens=False)["input_ids"]
+            full_time += time.perf_counter() - start
+            prompts += 1
+            identical += ids == whole
+
+    print(f"{len(records):,} messages, window of {len(context)} messages / {context.tokens} tokens")
+    print(f"add (tokenize + expire): {add_time / len(records) * 1e6:.1f} us/message, "
+          f"{len(records) / add_time:,.0f} messages/sec")
+    print(f"prompt from cached ids:  {prompt_time / prompts * 1e3:.3f} ms")
+    print(f"prompt tokenized whole:  {full_time / prompts * 1e3:.3f} ms")
+    print(f"cached ids identical to whole tokenization in {identical / prompts:.0%} of {prompts:,} prompts "
+          f"(messages cut to CHAT_CONTEXT_MESSAGE_TOKENS always differ)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import argparse
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+# Add the root directory to the system path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from utils.dataset_formatter import clean_message, iter_chat_logs
+from utils.utils import load_json, iter_chat_records
+
+
+def original_clean_message(message):
+    """clean_message before the patterns were fused and precompiled"""
+    message = re.sub(
+        r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', '', message)
+    message = re.sub(r'\\u[0-9a-fA-F]{4}(?:\\u[0-9a-fA-F]{4})?', '', message)
+    message = re.sub(r'\\[a-zA-Z0-9]{2,}', '', message)
+    message = message.strip()
+    return message if message else None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark message cleaning over the recorded chat logs.")
+    parser.add_argument("--workers", default=None,
+                        help="Comma separated worker counts (default: 1, 2, 4, ... up to the core count).")
+    parser.add_argument("--copies", type=int, default=4,
+                        help="Process the corpus this many times so pool startup is amortized.")
+    args = parser.parse_args()
+
+    files = sorted(Path('data/chat_logs').rglob('*.json')) + \
+        sorted(Path('data/chat_logs').rglob('*.jsonl'))
+    messages = [message for file in files for _, message in iter_chat_records(load_json(file))]
+    print(f"Corpus: {len(files)} chat logs, {len(messages)} messages, {os.cpu_count()} cores\n")
+
+    # Cleaning alone, without file loading
+    start = time.perf_counter()
+    original = [original_clean_message(message) for message in messages]
+    original_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fused = [clean_message(message) for message in messages]
+    fused_time = time.perf_counter() - start
+
+    mismatches = sum(a != b for a, b in zip(original, fused))
+    print(f"{'clean_message':<24}{'messages/sec':>14}")
+    print(f"{'three re.sub passes':<24}{len(messages) / original_time:>14,.0f}")
+    print(f"{'fused pattern':<24}{len(messages) / fused_time:>14,.0f}")
+    print(f"Outputs differing from the original: {mismatches}\n")
+
+    # Loading and cleaning whole files across the process pool
+    if args.workers:
+        worker_counts = [int(w) for w in args.workers.split(",")]
+    else:
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= (os.cpu_count() or 1):
+            worker_counts.append(worker_counts[-1] * 2)
+
+    new_logs = [(file, None) for file in files] * args.copies
+    print(f"{'workers':<10}{'messages/sec':>14}{'speedup':>10}")
+    baseline = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        count = sum(1 for _ in iter_chat_logs(new_logs, {}, workers=workers))
+        rate = count / (time.perf_counter() - start)
+        baseline = baseline or rate
+        print(f"{workers:<10}{rate:>14,.0f}{rate / baseline:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
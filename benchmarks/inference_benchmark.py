@@ -0,0 +1,163 @@
+import argparse
+import copy
+import json
+import math
+import multiprocessing
+import sys
+import time
+from pathlib import Path
+
+# Add the root directory to the system path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import torch
+
+from config.config import Config
+
+
+def memory_stats():
+    """Resident memory of this process in MiB, split into private and file-backed (Linux only)
+
+    Memory-mapped weights count as file-backed pages, which the kernel can
+    reclaim once they are no longer used.
+    """
+    stats = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'RssAnon', 'RssFile'):
+                stats[key] = int(value.split()[0]) / 1024
+    return stats
+
+
+def measure(mode, tokens, runs, cpu, results):
+    """Load the bot's model in a fresh process and time generation"""
+    if cpu:
+        Config.USE_CPU = True
+    from twitch.chatter_bot import ChatMessageGenerator
+    start = time.perf_counter()
+    generator = ChatMessageGenerator(use_merged=mode != "adapter",
+                                     quantization="int8" if mode == "int8" else "none")
+    startup = time.perf_counter() - start
+
+    inputs = generator.tokenizer(generator.PROMPT, return_tensors="pt",
+                                 return_token_type_ids=False).to(generator.model.device)
+    latencies = []
+    with torch.no_grad():
+        for run in range(runs + 1):
+            start = time.perf_counter()
+            generator.model.generate(**inputs, max_new_tokens=tokens, min_new_tokens=tokens, do_sample=False,
+                                     pad_token_id=generator.tokenizer.eos_token_id)
+            if run:  # The first run warms up
+                latencies.append((time.perf_counter() - start) / tokens)
+
+    latencies.sort()
+
+    # Time to first token through the bot's generate, with and without the prompt cache
+    ttft = {}
+    for cached in (False, True):
+        Config.PROMPT_CACHE = cached
+        times = []
+        for run in range(runs + 1):
+            start = time.perf_counter()
+            generator.generate(max_new_tokens=1)
+            if run:
+                times.append(time.perf_counter() - start)
+        ttft[cached] = sorted(times)[len(times) // 2] * 1000
+
+    results.put({"mode": mode, "startup": startup, "token_ms": latencies[len(latencies) // 2] * 1000,
+                 "ttft_ms": ttft[True], "uncached_ttft_ms": ttft[False],
+                 **memory_stats()})
+
+
+def load_messages(count):
+    """Read the first chat messages of the dataset"""
+    messages = []
+    with open(Config.DATASET_PATH, encoding='utf-8') as f:
+        for line in f:
+            messages.append(json.loads(line)["text"])
+            if len(messages) == count:
+                break
+    return messages
+
+
+def quality_check(count):
+    """Compare the int8 model's predictions with the float32 merged model's"""
+    from twitch.chatter_bot import ChatMessageGenerator, quantize_for_cpu
+
+    Config.USE_CPU = True
+    generator = ChatMessageGenerator(use_merged=True, quantization="none")
+    reference = copy.deepcopy(generator.model)
+    quantized = quantize_for_cpu(generator.model)
+    tokenizer = generator.tokenizer
+
+    # Teacher-forced next token predictions on real chat messages
+    agree = total = 0
+    kl = 0.0
+    nll = {"fp32": 0.0, "int8": 0.0}
+    with torch.no_grad():
+        for text in load_messages(count):
+            input_ids = tokenizer(text, return_tensors="pt", return_token_type_ids=False)["input_ids"]
+            if input_ids.shape[1] < 2:
+                continue
+            targets = input_ids[0, 1:]
+            log_probs = {}
+            for name, model in (("fp32", reference), ("int8", quantized)):
+                log_probs[name] = torch.log_softmax(model(input_ids).logits[0, :-1].float(), dim=-1)
+                nll[name] -= log_probs[name].gather(1, targets[:, None]).sum().item()
+            agree += (log_probs["fp32"].argmax(-1) == log_probs["int8"].argmax(-1)).sum().item()
+            kl += torch.nn.functional.kl_div(log_probs["int8"], log_probs["fp32"], log_target=True,
+                                             reduction="sum").item()
+            total += len(targets)
+
+    print(f"\nQuality on {total:,} tokens of {count} dataset messages:")
+    print(f"  top-1 agreement with fp32: {agree / total:.2%}")
+    print(f"  mean KL(fp32 || int8): {kl / total:.5f} nats/token")
+    print(f"  perplexity: fp32 {math.exp(nll['fp32'] / total):.2f}, int8 {math.exp(nll['int8'] / total):.2f}")
+
+    # Sample a few messages from each with the same seeds
+    inputs = tokenizer(generator.PROMPT, return_tensors="pt", return_token_type_ids=False)
+    print("\nSamples (same seed per row):")
+    for seed in range(3):
+        for name, model in (("fp32", reference), ("int8", quantized)):
+            torch.manual_seed(seed)
+            with torch.no_grad():
+                output = model.generate(**inputs, max_new_tokens=40, temperature=0.7, top_p=0.9, do_sample=True,
+                                        pad_token_id=tokenizer.eos_token_id)
+            reply = tokenizer.decode(output[0, inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+            print(f"  {seed} {name}: {reply.strip()!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare bot startup time, per-token latency and memory of the inference modes.")
+    parser.add_argument("--modes", default="adapter,merged,int8",
+                        help="Comma separated modes to compare: adapter, merged and int8 (merged, CPU only).")
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens generated per run.")
+    parser.add_argument("--runs", type=int, default=5, help="Timed generation runs per mode.")
+    parser.add_argument("--cpu", action="store_true", help="Run on CPU even if CUDA is available.")
+    parser.add_argument("--quality", type=int, default=0,
+                        help="Also compare int8 and fp32 predictions on this many dataset messages.")
+    args = parser.parse_args()
+
+    print(f"{'mode':>10}{'startup (s)':>13}{'ms/token':>10}{'TTFT ms':>9}{'uncached':>10}"
+          f"{'RSS MiB':>10}{'anon MiB':>10}{'file MiB':>10}")
+    for mode in args.modes.split(","):
+        # Load once to warm the page cache, then measure a fresh process
+        results = multiprocessing.Queue()
+        for _ in range(2):
+            process = multiprocessing.Process(target=measure, args=(mode, args.tokens, args.runs, args.cpu, results))
+            process.start()
+            result = results.get()
+            process.join()
+
+        print(f"{result['mode']:>10}{result['startup']:>13.2f}{result['token_ms']:>10.2f}"
+              f"{result['ttft_ms']:>9.1f}{result['uncached_ttft_ms']:>10.1f}"
+              f"{result['VmRSS']:>10,.0f}{result['RssAnon']:>10,.0f}{result['RssFile']:>10,.0f}")
+
+    if args.quality:
+        quality_check(args.quality)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Add the root directory to the system path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from transformers import AutoTokenizer
+
+from config.config import Config
+from twitch.chat_context import ChatContext
+from twitch.inference_server import InferenceClient
+from utils.utils import iter_chat_records, load_json
+
+
+def chat_prompts(count, messages_between=50):
+    """Prompt token ids with different windows of the recorded chat logs, one per bot"""
+    context = ChatContext(AutoTokenizer.from_pretrained(Config.MODEL_PATH))
+    prompts = []
+    i = 0
+    for path in sorted(Path(Config.CHAT_LOGS_DIR).rglob('*.json*')):
+        for username, message in iter_chat_records(load_json(path)):
+            context.add(username, message, timestamp=i / 10)
+            i += 1
+            if i % messages_between == 0:
+                prompts.append(context.prompt_ids(now=i / 10))
+                if len(prompts) == count:
+                    return prompts
+    return prompts
+
+
+async def bot(url, requests, count, prompt_ids, latencies, failures):
+    """Request candidates back to back, like one bot's candidate buffer"""
+    client = InferenceClient(url)
+    try:
+        for _ in range(requests):
+            start = time.perf_counter()
+            try:
+                await client.generate_candidates(count, prompt_ids=prompt_ids)
+                latencies.append(time.perf_counter() - start)
+            except Exception as e:
+                failures.append(str(e))
+    finally:
+        await client.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Load a running inference server (python main.py serve) with several concurrent bots.")
+    parser.add_argument("--url", default=Config.INFERENCE_SERVER_URL or
+                        f"http://{Config.INFERENCE_SERVER_HOST}:{Config.INFERENCE_SERVER_PORT}")
+    parser.add_argument("--bots", default="1,2,4", help="Comma separated numbers of concurrent bots to try.")
+    parser.add_argument("--requests", type=int, default=4, help="Requests each bot makes.")
+    parser.add_argument("--count", type=int, default=Config.CANDIDATES_PER_BATCH, help="Messages per request.")
+    parser.add_argument("--chat", action="store_true", help="Give each bot its own chat window prompt.")
+    args = parser.parse_args()
+
+    bot_counts = [int(value) for value in args.bots.split(",")]
+    prompts = chat_prompts(max(bot_counts)) if args.chat else []
+    if args.chat and len(prompts) < max(bot_counts):
+        print(f"Not enough chat logs in {Config.CHAT_LOGS_DIR} for {max(bot_counts)} prompts")
+        return
+
+    print(f"{'bots':>5}{'messages/s':>12}{'p50 s':>8}{'p95 s':>8}{'failed':>8}")
+    for bots in bot_counts:
+        latencies = []
+        failures = []
+        start = time.perf_counter()
+        await asyncio.gather(*(bot(args.url, args.requests, args.count, prompts[i] if prompts else None,
+                                   latencies, failures) for i in range(bots)))
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        p50 = statistics.median(latencies) if latencies else float("nan")
+        p95 = latencies[int(len(latencies) * 0.95)] if latencies else float("nan")
+        print(f"{bots:>5}{len(latencies) * args.count / elapsed:>12.2f}{p50:>8.2f}{p95:>8.2f}{len(failures):>8}")
+        for failure in sorted(set(failures)):
+            print(f"      {failure}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+import argparse
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+# Add the root directory to the system path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from twitch.irc import parse_frame
+from utils.utils import load_json, iter_chat_records
+
+
+def load_corpus():
+    """Load (username, message) pairs from the recorded chat logs"""
+    chat_logs = sorted(Path('data/chat_logs').rglob('*.json')) + \
+        sorted(Path('data/chat_logs').rglob('*.jsonl'))
+    corpus = []
+    for file in chat_logs:
+        corpus.extend(iter_chat_records(load_json(file)))
+    return corpus
+
+
+def build_line(username, text, rng):
+    """Build a tagged PRIVMSG line as sent by Twitch"""
+    login = username.lower()
+    tags = (
+        f"@badge-info=;badges={rng.choice(['', 'subscriber/12', 'vip/1'])};"
+        f"client-nonce={rng.getrandbits(128):032x};color=#1E90FF;"
+        f"display-name={username};emotes=;first-msg=0;flags=;"
+        f"id={rng.getrandbits(128):032x};mod=0;returning-chatter=0;room-id=123456;"
+        f"subscriber=0;tmi-sent-ts=1700000000000;turbo=0;"
+        f"user-id={rng.randrange(10 ** 9)};user-type="
+    )
+    return f"{tags} :{login}!{login}@{login}.tmi.twitch.tv PRIVMSG #channel :{text}\r\n"
+
+
+def regex_parse(message):
+    """The original regex-based extraction from TwitchChatReader"""
+    if "PRIVMSG" not in message:
+        return None
+    username_match = re.search(r"display-name=([^;]+)", message)
+    message_match = re.search(r"PRIVMSG #\w+ :(.+)", message)
+    if username_match and message_match:
+        username = username_match.group(1)
+        msg_text = message_match.group(1)
+        if not username:
+            alt_username_match = re.search(r":(\w+)!", message)
+            if alt_username_match:
+                username = alt_username_match.group(1)
+        return username, msg_text.rstrip('\r\n ')
+    return None
+
+
+def single_pass_parse(frame):
+    """The single-pass parser, extracting the same fields as the regex path"""
+    results = []
+    for message in parse_frame(frame):
+        if message.command == "PRIVMSG":
+            username = message.tag("display-name") or message.nick
+            results.append((username, message.text.rstrip('\r\n ')))
+    return results
+
+
+def single_pass_parse_with_tags(frame):
+    """The single-pass parser, also decoding every tag for the message store"""
+    results = []
+    for message in parse_frame(frame):
+        if message.command == "PRIVMSG":
+            tags = message.tags
+            username = tags.get("display-name") or message.nick
+            results.append((username, message.text.rstrip('\r\n '), tags))
+    return results
+
+
+def run(func, frames, repeat):
+    """Return the best lines/sec over several runs"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            func(frame)
+        best = min(best, time.perf_counter() - start)
+    return len(frames) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the IRC line parser against the original regex path.")
+    parser.add_argument("--lines", type=int, default=100000,
+                        help="Number of PRIVMSG lines to parse.")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Number of timed runs, the best is reported.")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    corpus = load_corpus()
+    frames = [build_line(*rng.choice(corpus), rng) for _ in range(args.lines)]
+
+    regex_rate = run(regex_parse, frames, args.repeat)
+    parser_rate = run(single_pass_parse, frames, args.repeat)
+    tags_rate = run(single_pass_parse_with_tags, frames, args.repeat)
+
+    print(f"Parsing {len(frames)} tagged PRIVMSG lines (best of {args.repeat})\n")
+    print(f"{'path':<14}{'lines/sec':>14}")
+    print(f"{'regex':<14}{regex_rate:>14,.0f}")
+    print(f"{'single-pass':<14}{parser_rate:>14,.0f}")
+    print(f"{'+ all tags':<14}{tags_rate:>14,.0f}")
+    print(f"\nSingle-pass vs regex on the same fields: {parser_rate / regex_rate:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+# Add the root directory to the system path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from twitch.message_store import MessageStore
+from utils.utils import load_json, iter_chat_records
+
+# Emotes commonly seen in the recorded chats, used for synthetic emote tags
+EMOTES = ["LUL", "SAJ", "PauseChamp", "KEKW", "Kappa", "o7", "LOLL", "OMEGALUL"]
+
+
+def load_corpus():
+    """Load (username, message) pairs from the recorded chat logs"""
+    chat_logs = sorted(Path('data/chat_logs').rglob('*.json')) + \
+        sorted(Path('data/chat_logs').rglob('*.jsonl'))
+    corpus = []
+    for file in chat_logs:
+        corpus.extend(iter_chat_records(load_json(file)))
+    return corpus
+
+
+def synthesize_messages(corpus, count, seed=0):
+    """Yield tagged messages resembling live Twitch traffic
+
+    Messages are generated lazily so that the memory measured afterwards is
+    only what each store chose to retain.
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        username, text = rng.choice(corpus)
+        emote = rng.choice(EMOTES)
+        text = f"{emote} {text}"
+        tags = {
+            "badge-info": "",
+            "badges": rng.choice(["", "subscriber/12", "vip/1"]),
+            "client-nonce": f"{rng.getrandbits(128):032x}",
+            "color": rng.choice(["#FF0000", "#1E90FF", ""]),
+            "display-name": username,
+            "emotes": f"{abs(hash(emote)) % 100000}:0-{len(emote) - 1}",
+            "first-msg": "0",
+            "flags": "",
+            "id": f"{rng.getrandbits(128):032x}",
+            "mod": "0",
+            "room-id": "123456",
+            "subscriber": rng.choice(["0", "1"]),
+            "tmi-sent-ts": str(1700000000000 + i),
+            "turbo": "0",
+            "user-id": str(abs(hash(username)) % 10 ** 9),
+            "user-type": ""
+        }
+        # Simulate strings arriving fresh off the socket rather than shared
+        yield (username.encode().decode(), text.encode().decode(),
+               {k.encode().decode(): v.encode().decode() for k, v in tags.items()})
+
+
+def bench_plain_dict(messages):
+    """The original reader: only the latest message per user survives"""
+    store = {}
+    for username, text, _ in messages:
+        store[username] = text
+    return store
+
+
+def bench_dict_records(messages):
+    """A naive store keeping every message as a dictionary"""
+    store = []
+    for username, text, tags in messages:
+        store.append({"username": username, "message": text,
+                      "timestamp": time.time(), "tags": tags})
+    return store
+
+
+def bench_message_store(messages):
+    """The compact, interned message store"""
+    store = MessageStore(max_messages=float("inf"))
+    for username, text, tags in messages:
+        store.add(username, text, time.time(), tags)
+    return store
+
+
+def measure(func, corpus, count):
+    """Measure the retained memory and time per message of a store"""
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    store = func(synthesize_messages(corpus, count))
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    # Time separately, without tracing and without generating messages
+    messages = list(synthesize_messages(corpus, count))
+    start = time.perf_counter()
+    func(messages)
+    elapsed = time.perf_counter() - start
+    return store, retained, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark per-message overhead of the chat message store.")
+    parser.add_argument("--messages", type=int, default=100000,
+                        help="Number of synthetic messages to store.")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    count = args.messages
+    print(f"Corpus: {len(corpus)} recorded messages, benchmarking {count} messages\n")
+    print(f"{'store':<16}{'kept':>10}{'bytes/msg':>12}{'us/msg':>10}")
+
+    for name, func in [("plain dict", bench_plain_dict),
+                       ("dict records", bench_dict_records),
+                       ("MessageStore", bench_message_store)]:
+        store, retained, elapsed = measure(func, corpus, count)
+        print(f"{name:<16}{len(store):>10}{retained / count:>12.1f}"
+              f"{elapsed / count * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
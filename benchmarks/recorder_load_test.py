@@ -0,0 +1,113 @@
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add the root directory to the system path
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+from config.config import Config
+from twitch.chat_reader_pool import ChatReaderPool
+from utils.utils import load_json
+
+
+def percentile(values, fraction):
+    """Return a percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run_load(rate, duration, channels, lines_per_frame, port, source):
+    """Replay chat at a given rate and measure what the recorder keeps up with"""
+    server = subprocess.Popen(
+        [sys.executable, str(ROOT / "twitch" / "replay_server.py"),
+         "--port", str(port), "--rate", str(rate), "--duration", str(duration),
+         "--lines-per-frame", str(lines_per_frame), "--ping-interval", "5",
+         "--source", source, "--logs", str(ROOT / "data" / "chat_logs")],
+        stdout=subprocess.PIPE, text=True)
+
+    # Give the server time to load the replay corpus and start listening
+    await asyncio.sleep(3)
+
+    Config.TWITCH_IRC_URL = f"ws://localhost:{port}"
+    pool = ChatReaderPool(channels=[f"load{i}" for i in range(channels)])
+    reader_task = asyncio.create_task(pool.start())
+    start = time.monotonic()
+
+    # Wait for the server to finish streaming, then let the recorder catch up
+    while server.poll() is None:
+        await asyncio.sleep(0.5)
+    elapsed = time.monotonic() - start
+    await pool.stop()
+    await reader_task
+
+    server_stats = json.loads(server.stdout.read().strip().splitlines()[-1])
+
+    # End-to-end latency from the server's send timestamp to the reader storing it
+    latencies = []
+    for segment in Path("data/chat_logs").rglob("*.jsonl"):
+        for record in load_json(segment):
+            sent = int(record["tags"]["tmi-sent-ts"]) / 1000
+            latencies.append(record["timestamp"] - sent)
+    latencies.sort()
+
+    reader_stats = pool.stats
+    written = reader_stats["messages_written"]
+    sent = server_stats["messages_sent"]
+    return {
+        "target_rate": rate * channels,
+        "sent_rate": sent / elapsed,
+        "recorded_rate": written / elapsed,
+        "loss": 1 - written / sent if sent else 0.0,
+        "frames_dropped": reader_stats["frames_dropped"],
+        "p50_latency": percentile(latencies, 0.5),
+        "p99_latency": percentile(latencies, 0.99),
+        "max_latency": latencies[-1] if latencies else 0.0,
+        "max_queue_lag": reader_stats["max_queue_lag"],
+        "server_behind": server_stats["max_send_behind"],
+        "max_pong_latency": server_stats["max_pong_latency"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Find the message rate at which the chat recorder falls behind.")
+    parser.add_argument("--rates", default="100,1000,5000,10000",
+                        help="Comma separated messages/sec per channel to try.")
+    parser.add_argument("--duration", type=float, default=10,
+                        help="Seconds to stream at each rate.")
+    parser.add_argument("--channels", type=int, default=1,
+                        help="Number of channels to stream in parallel.")
+    parser.add_argument("--lines-per-frame", type=int, default=10)
+    parser.add_argument("--port", type=int, default=6667)
+    parser.add_argument("--source", choices=["logs", "synthetic"], default="logs")
+    args = parser.parse_args()
+
+    print(f"{'target/s':>10}{'sent/s':>10}{'kept/s':>10}{'loss':>8}{'dropped':>9}"
+          f"{'p50 lat':>9}{'p99 lat':>9}{'max lat':>9}{'pong':>8}")
+    for rate in [float(r) for r in args.rates.split(",")]:
+        # Record into a scratch directory so real chat logs are untouched
+        with tempfile.TemporaryDirectory() as scratch:
+            cwd = os.getcwd()
+            os.chdir(scratch)
+            try:
+                result = asyncio.run(run_load(rate, args.duration, args.channels,
+                                              args.lines_per_frame, args.port, args.source))
+            finally:
+                os.chdir(cwd)
+
+        print(f"{result['target_rate']:>10.0f}{result['sent_rate']:>10.0f}"
+              f"{result['recorded_rate']:>10.0f}{result['loss']:>8.1%}{result['frames_dropped']:>9}"
+              f"{result['p50_latency']:>9.3f}{result['p99_latency']:>9.3f}"
+              f"{result['max_latency']:>9.3f}{result['max_pong_latency']:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from itertools import islice
+from pathlib import Path
+
+# Add the root directory to the system path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from transformers import AutoTokenizer
+
+from config.config import Config
+from fine_tuning.streaming import StreamingMessages
+from fine_tuning.token_cache import TokenCache
+
+
+def memory_stats():
+    """Peak and anonymous resident memory of this process in MiB (Linux only)"""
+    stats = {}
+    with open('/proc/self/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmHWM', 'RssAnon'):
+                stats[key] = int(value.split()[0]) / 1024
+    return stats
+
+
+def stream(cache_dir, model, pack, examples, results):
+    """Stream examples from a prepared cache in a fresh process"""
+    tokenizer = AutoTokenizer.from_pretrained(model)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    cache = TokenCache(tokenizer, cache_dir=cache_dir)
+    cache.update(Path(cache_dir) / 'dataset.jsonl')
+
+    baseline = memory_stats()
+    dataset = StreamingMessages(cache, tokenizer.eos_token_id, pack=pack)
+    start = time.perf_counter()
+    tokens = sum(len(example["input_ids"]) for example in islice(dataset, examples))
+    elapsed = time.perf_counter() - start
+
+    # Resuming skips straight to the position without reading tokens
+    resumed = StreamingMessages(cache, tokenizer.eos_token_id, pack=pack)
+    resumed.load_state_dict({"position": examples})
+    start = time.perf_counter()
+    next(iter(resumed))
+    resume_time = time.perf_counter() - start
+
+    after = memory_stats()
+    results.put({"messages": len(cache), "tokens_per_sec": tokens / elapsed, "resume": resume_time,
+                 "peak_growth": after["VmHWM"] - baseline["VmHWM"],
+                 "anon_growth": after["RssAnon"] - baseline["RssAnon"]})
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that streaming memory stays flat as the dataset grows.")
+    parser.add_argument("--model", default=Config.BASE_MODEL, help="Model whose tokenizer to use.")
+    parser.add_argument("--copies", default="1,4,16",
+                        help="Comma separated dataset sizes, as copies of the current dataset.")
+    parser.add_argument("--examples", type=int, default=50000, help="Examples to stream per size.")
+    parser.add_argument("--pack", action="store_true", help="Stream packed sequences.")
+    args = parser.parse_args()
+
+    with open(Config.DATASET_PATH, 'rb') as f:
+        dataset = f.read()
+
+    print(f"{'messages':>12}{'tokens/sec':>14}{'resume (s)':>12}{'peak +MiB':>11}{'anon +MiB':>11}")
+    for copies in [int(c) for c in args.copies.split(",")]:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with open(Path(cache_dir) / 'dataset.jsonl', 'wb') as f:
+                for _ in range(copies):
+                    f.write(dataset)
+
+            # Tokenize first so the measured process only streams
+            results = multiprocessing.Queue()
+            for _ in range(2):
+                process = multiprocessing.Process(
+                    target=stream, args=(cache_dir, args.model, args.pack, args.examples, results))
+                process.start()
+                result = results.get()
+                process.join()
+
+        print(f"{result['messages']:>12,}{result['tokens_per_sec']:>14,.0f}{result['resume']:>12.2f}"
+              f"{result['peak_growth']:>11.1f}{result['anon_growth']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,45 @@ class Config:
     TWITCH_REFRESH_TOKEN = os.getenv('REFRESH_TOKEN')
     TWITCH_CLIENT_ID = os.getenv('CLIENT_ID')
     TWITCH_CHANNEL = os.getenv('CHANNEL')
-    TWITCH_IRC_URL = 'wss://irc-ws.chat.twitch.tv:443'
+    # Comma separated channels to record, defaults to CHANNEL
+    TWITCH_CHANNELS = [c.strip() for c in (os.getenv('CHANNELS') or os.getenv('CHANNEL') or '').split(',') if c.strip()]
+    TWITCH_IRC_URL = os.getenv('IRC_URL', 'wss://irc-ws.chat.twitch.tv:443')
     MODEL_PATH = 'model/fine_tuned_model'
     BASE_MODEL = os.getenv('MODEL')
 
+    # Dataset configs
+    CHAT_LOGS_DIR = 'data/chat_logs'
+    DATASET_PATH = 'data/formatted_logs/dataset.jsonl'
+    LEGACY_DATASET_PATH = 'data/formatted_logs/dataset.json'  # Converted on the next format
+    FORMATTER_WORKERS = int(os.getenv('FORMATTER_WORKERS', os.cpu_count() or 1))
+
+    # Deduplication configs
+    DEDUP_ENABLED = True
+    DEDUP_STATE_PATH = 'data/formatted_logs/dedup_state.npz'
+    DEDUP_STATE_RECENT = 500000  # Most recent unique messages whose counts carry over, on top of the capped ones
+    DEDUP_MAX_REPEATS = 2  # Back to back copies of a phrase kept within a message
+    DEDUP_MAX_COPIES = 3  # Copies of an identical message kept across the dataset
+    DEDUP_MAX_NEAR_COPIES = 3  # Copies of near-duplicate messages kept
+    DEDUP_SIMHASH_DISTANCE = 3  # Max differing SimHash bits for a near-duplicate
+    DEDUP_NEAR_MIN_CHARS = 20  # Shorter messages are only deduplicated exactly
+    DATASET_MANIFEST_PATH = 'data/formatted_logs/manifest.json'
+
+    # Chat log writer configs
+    CHAT_LOG_SEGMENT_MAX_BYTES = 8 * 1024 * 1024  # Rotate segments at 8 MiB
+    CHAT_LOG_SEGMENT_MAX_SECONDS = 30 * 60  # or after 30 minutes
+    CHAT_LOG_FSYNC = os.getenv('CHAT_LOG_FSYNC', 'rotate')  # always, rotate or never
+    MESSAGE_STORE_MAX_MESSAGES = 50000  # Spill to disk beyond this many messages in memory
+
+    # Chat reader pipeline configs
+    CHAT_READER_QUEUE_SIZE = 10000  # Frames waiting to be parsed
+    CHAT_WRITER_QUEUE_SIZE = 64  # Batches waiting to be written
+    CHAT_READER_OVERFLOW = os.getenv('CHAT_READER_OVERFLOW', 'drop')  # drop or block
+
+    # Multi-channel recording configs
+    CHANNELS_PER_CONNECTION = 50
+    TWITCH_JOIN_RATE_LIMIT = 20  # Twitch allows 20 JOINs
+    TWITCH_JOIN_RATE_WINDOW = 10  # per 10 seconds
+
     # Fine-tuning configs
     MAX_SEQ_LENGTH = 2048
     LOAD_IN_4BIT = True
@@ -24,5 +59,87 @@ class Config:
     LEARNING_RATE = 2e-4
     WEIGHT_DECAY = 0.01
     TRAINING_STEPS = 500
+    SAVE_STEPS = 50  # Checkpoint interval, training resumes from the latest checkpoint
+    TOKEN_CACHE_DIR = 'data/token_cache'
+    TOKEN_CACHE_SHARD_MESSAGES = 1000000  # Messages per token cache shard
+    SHUFFLE_BUFFER_SIZE = 10000  # Messages mixed together when streaming the training data
+    RECENCY_WEIGHT = float(os.getenv('RECENCY_WEIGHT', 1.0))  # Oversample each newer token cache shard this much
+    PACK_SEQUENCES = os.getenv('PACK_SEQUENCES', 'false').lower() == 'true'  # Pack many messages per sequence
+    REPLAY_RATIO = 0.25  # Older messages replayed per new message when training continually
+    USE_CPU = False
+
+    # Training profiles override the fine-tuning configs above. gpu keeps
+    # them as they are, cpu trains without quantization on a GPU-less host
+    # and smoke trains a tiny model for a few steps to test the pipeline.
+    TRAINING_PROFILE = os.getenv('TRAINING_PROFILE', 'gpu')
+    CPU_THREADS = int(os.getenv('CPU_THREADS', 0))  # 0 lets torch decide
+    CPU_BF16 = os.getenv('CPU_BF16', 'auto')  # auto, true or false
+    SMOKE_MODEL = os.getenv('SMOKE_MODEL', 'hf-internal-testing/tiny-random-LlamaForCausalLM')
+    TRAINING_PROFILES = {
+        'gpu': {},
+        'cpu': {
+            'USE_CPU': True,
+            'LOAD_IN_4BIT': False,
+            'MAX_SEQ_LENGTH': 512,
+            'PACK_SEQUENCES': True,
+            'BATCH_SIZE': 4,
+            'GRADIENT_ACCUMULATION_STEPS': 2,
+            'TRAINING_STEPS': 100
+        },
+        'smoke': {
+            'USE_CPU': True,
+            'BASE_MODEL': SMOKE_MODEL,
+            'MODEL_PATH': 'model/smoke_model',
+            'MERGED_MODEL_PATH': 'model/smoke_merged_model',
+            'LOAD_IN_4BIT': False,
+            'MAX_SEQ_LENGTH': 128,
+            'PACK_SEQUENCES': True,
+            'BATCH_SIZE': 2,
+            'GRADIENT_ACCUMULATION_STEPS': 1,
+            'WARMUP_STEPS': 1,
+            'TRAINING_STEPS': 5
+        }
+    }
 
     MESSAGE_FREQUENCY = 120  # Generate a message every 120 seconds
+    APPROVAL_QUEUE_SIZE = 5  # Generated messages waiting for approval before generation pauses
+    PROMPT_CACHE = os.getenv('PROMPT_CACHE', 'true').lower() == 'true'  # Reuse the prompt's KV cache across generations
+    MAX_NEW_TOKENS = 80  # Upper bound on a generated message, most stop at their first newline
+    GENERATION_MAX_TIME = float(os.getenv('GENERATION_MAX_TIME', 10.0))  # Seconds before a generate call is cut short
+    DRAFT_MODEL = os.getenv('DRAFT_MODEL')  # Small model for assisted generation, off by default
+    DRAFT_LOOKAHEAD = int(os.getenv('DRAFT_LOOKAHEAD', 5))  # Tokens the draft model proposes per step
+    DRAFT_LOOKAHEAD_SCHEDULE = 'heuristic'  # heuristic adapts the lookahead to the acceptance rate, or constant
+    DRAFT_CONFIDENCE = 0.4  # Stop drafting a step when the draft's next token probability falls below this
+    CANDIDATES_PER_BATCH = 4  # Messages sampled per batched generate call
+    CANDIDATE_BUFFER_SIZE = 8  # Ranked messages kept ready to send
+    CANDIDATE_MIN_CHARS = 2
+    CANDIDATE_MAX_CHARS = 500  # Twitch's message length limit
+    CANDIDATE_MAX_REPEATS = 4  # Back to back copies of a phrase kept in a candidate, more are collapsed
+    RECENT_MESSAGES = 50  # Taken messages that new candidates must not nearly duplicate
+    CHAT_CONTEXT = os.getenv('CHAT_CONTEXT', 'false').lower() == 'true'  # Prompt with recent chat messages
+    CHAT_CONTEXT_TOKENS = 256  # Token budget of the recent chat window
+    CHAT_CONTEXT_SECONDS = 120  # Messages leave the window after this long
+    CHAT_CONTEXT_MESSAGE_TOKENS = 64  # Longer messages are cut to this many tokens
+    CHAT_CONTEXT_CANDIDATE_AGE = 30  # Seconds a reply to the chat window stays ready to send
+    INFERENCE_SERVER_URL = os.getenv('INFERENCE_SERVER_URL')  # e.g. http://127.0.0.1:8765 to use a shared server
+    INFERENCE_SERVER_HOST = os.getenv('INFERENCE_SERVER_HOST', '127.0.0.1')
+    INFERENCE_SERVER_PORT = int(os.getenv('INFERENCE_SERVER_PORT', 8765))
+    INFERENCE_SERVER_QUEUE_SIZE = 32  # Requests waiting for the model before new ones are turned away
+    INFERENCE_SERVER_MAX_BATCH = 16  # Messages generated together in one batched call
+    INFERENCE_SERVER_BATCH_WAIT = 0.05  # Seconds to wait for more requests to join a batch
+    INFERENCE_SERVER_TIMEOUT = float(os.getenv('INFERENCE_SERVER_TIMEOUT', 60.0))  # Seconds before a request gives up
+    MERGED_MODEL_PATH = 'model/merged_model'  # Adapter merged into the base model by `main.py export`
+    EXPORT_DTYPE = os.getenv('EXPORT_DTYPE', 'float16')  # float32 skips the upcast when the bot runs on CPU
+    CPU_QUANTIZATION = os.getenv('CPU_QUANTIZATION', 'none')  # none or int8, for the merged model on CPU
+
+    @classmethod
+    def apply_training_profile(cls, profile=None):
+        """Override the fine-tuning configs with those of a training profile"""
+        profile = profile or cls.TRAINING_PROFILE
+        for key, value in cls.TRAINING_PROFILES[profile].items():
+            # Settings given in the environment, like PACK_SEQUENCES, win
+            # over the profile's defaults
+            if os.getenv(key) is not None:
+                continue
+            setattr(cls, key, value)
+        cls.TRAINING_PROFILE = profile
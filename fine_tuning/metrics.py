@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+
+import torch
+from transformers import TrainerCallback
+
+from utils.utils import get_timestamp
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_memory_mb():
+    """Peak GPU memory allocated since the last reset, or peak process RSS on CPU"""
+    if torch.cuda.is_available():
+        return torch.cuda.max_memory_allocated() / 2 ** 20
+    if resource is None:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+class TrainingMetrics(TrainerCallback):
+    """Record where training time goes, one JSON line per optimizer step
+
+    Each step records its wall time, the time spent waiting for the data
+    loader, real and padded tokens per second, the padding ratio and peak
+    memory. Checkpoint saves are recorded separately and left out of step
+    times. A summary is logged and appended to the file when training ends.
+
+    Token counts come from the collator, so wrap it with ``wrap_collator``.
+    Data loader wait is the time between the end of one forward/backward
+    pass and the start of the next forward pass.
+    """
+
+    def __init__(self, path=None, run_config=None):
+        """Initialize the training metrics callback"""
+        self.path = path or f"logs/training_metrics_{get_timestamp()}.jsonl"
+        self.run_config = run_config or {}
+        self.batches = deque()  # (real, padded) tokens of batches waiting for their forward pass
+        self.file = None
+        self.hook = None
+        self.step_start = None
+        self.compute_end = None
+        self.reset_step()
+        self.totals = {"steps": 0, "step_time": 0.0, "data_wait": 0.0, "real_tokens": 0,
+                       "padded_tokens": 0, "saves": 0, "save_time": 0.0, "peak_memory_mb": 0.0}
+
+    def reset_step(self):
+        self.step_data_wait = 0.0
+        self.step_real_tokens = 0
+        self.step_padded_tokens = 0
+
+    def wrap_collator(self, collator):
+        """Wrap a data collator so the tokens of every batch are counted"""
+        def collate(features):
+            batch = collator(features)
+            real = sum(len(feature["input_ids"]) for feature in features)
+            self.batches.append((real, batch["input_ids"].numel()))
+            return batch
+        return collate
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def forward_pre_hook(self, module, args):
+        if not module.training:
+            return
+        now = time.perf_counter()
+        self.step_data_wait += now - self.compute_end
+        if self.batches:
+            real, padded = self.batches.popleft()
+            self.step_real_tokens += real
+            self.step_padded_tokens += padded
+
+    def on_train_begin(self, args, state, control, model=None, **kwargs):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.write({"event": "config", **self.run_config})
+        self.hook = model.register_forward_pre_hook(self.forward_pre_hook)
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        self.step_start = self.compute_end = time.perf_counter()
+
+    def on_substep_end(self, args, state, control, **kwargs):
+        self.compute_end = time.perf_counter()
+
+    def on_step_end(self, args, state, control, **kwargs):
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        step_time = now - self.step_start
+        memory = peak_memory_mb()
+
+        self.write({
+            "event": "step",
+            "step": state.global_step,
+            "step_time": step_time,
+            "data_wait": self.step_data_wait,
+            "real_tokens": self.step_real_tokens,
+            "padded_tokens": self.step_padded_tokens,
+            "tokens_per_sec": self.step_real_tokens / step_time,
+            "padded_tokens_per_sec": self.step_padded_tokens / step_time,
+            "padding_ratio": 1 - self.step_real_tokens / max(self.step_padded_tokens, 1),
+            "peak_memory_mb": memory
+        })
+
+        self.totals["steps"] += 1
+        self.totals["step_time"] += step_time
+        self.totals["data_wait"] += self.step_data_wait
+        self.totals["real_tokens"] += self.step_real_tokens
+        self.totals["padded_tokens"] += self.step_padded_tokens
+        self.totals["peak_memory_mb"] = max(self.totals["peak_memory_mb"], memory)
+        self.reset_step()
+        self.step_start = self.compute_end = now
+
+    def on_log(self, args, state, control, **kwargs):
+        # Logging between steps is not time spent waiting for data
+        self.compute_end = time.perf_counter()
+
+    def on_save(self, args, state, control, **kwargs):
+        now = time.perf_counter()
+        save_time = now - self.compute_end
+        self.write({"event": "save", "step": state.global_step, "save_time": save_time})
+        self.totals["saves"] += 1
+        self.totals["save_time"] += save_time
+
+        # Leave the save out of the next step's time
+        self.step_start += save_time
+        self.compute_end = now
+
+    def summary(self):
+        totals = self.totals
+        steps = max(totals["steps"], 1)
+        step_time = max(totals["step_time"], 1e-9)
+        return {
+            "steps": totals["steps"],
+            "mean_step_time": totals["step_time"] / steps,
+            "tokens_per_sec": totals["real_tokens"] / step_time,
+            "padded_tokens_per_sec": totals["padded_tokens"] / step_time,
+            "padding_ratio": 1 - totals["real_tokens"] / max(totals["padded_tokens"], 1),
+            "data_wait_share": totals["data_wait"] / step_time,
+            "peak_memory_mb": totals["peak_memory_mb"],
+            "saves": totals["saves"],
+            "mean_save_time": totals["save_time"] / max(totals["saves"], 1)
+        }
+
+    def on_train_end(self, args, state, control, **kwargs):
+        summary = self.summary()
+        self.write({"event": "summary", **summary})
+        self.file.close()
+        self.hook.remove()
+
+        logging.info(
+            f"Training metrics: {summary['steps']} steps, {summary['mean_step_time']:.3f}s/step, "
+            f"{summary['tokens_per_sec']:,.0f} real tokens/s ({summary['padded_tokens_per_sec']:,.0f} padded), "
+            f"{summary['padding_ratio']:.1%} padding, {summary['data_wait_share']:.1%} waiting for data, "
+            f"peak memory {summary['peak_memory_mb']:,.0f} MiB, "
+            f"{summary['saves']} checkpoints at {summary['mean_save_time']:.2f}s each")
+        logging.info(f"Training metrics written to {self.path}")
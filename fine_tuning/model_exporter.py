@@ -0,0 +1,83 @@
+import hashlib
+import logging
+import os
+
+import torch
+from peft import PeftModel
+from transformers import AutoModelForCausalLM, AutoTokenizer
+
+from config.config import Config
+from utils.utils import load_json, save_json
+
+EXPORT_STATE_FILE = "export.json"
+ADAPTER_WEIGHTS_FILES = ("adapter_model.safetensors", "adapter_model.bin")
+
+
+def adapter_digest(adapter_path=None):
+    """Hash the adapter config and weights, or None if there is no adapter"""
+    adapter_path = adapter_path or Config.MODEL_PATH
+    digest = hashlib.sha256()
+    found = False
+    for name in ("adapter_config.json",) + ADAPTER_WEIGHTS_FILES:
+        path = os.path.join(adapter_path, name)
+        if os.path.exists(path):
+            found = found or name != "adapter_config.json"
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+    return digest.hexdigest() if found else None
+
+
+def merged_model_is_current(merged_path=None, adapter_path=None):
+    """Check that the merged model was exported from the current adapter"""
+    merged_path = merged_path or Config.MERGED_MODEL_PATH
+    state_path = os.path.join(merged_path, EXPORT_STATE_FILE)
+    if not os.path.exists(state_path):
+        return False
+
+    state = load_json(state_path)
+    current = adapter_digest(adapter_path)
+    return bool(state) and current is not None and state.get("adapter_sha256") == current
+
+
+def export_model():
+    """Merge the fine-tuned adapter into the base model and save it as safetensors
+
+    The merged model loads in a single memory-mapped read and runs without
+    the LoRA layers. The adapter's hash is recorded so the bot can tell when
+    the merged model is stale.
+    """
+    digest = adapter_digest()
+    if digest is None:
+        logging.error(f"No fine-tuned adapter found in {Config.MODEL_PATH}, train a model first")
+        return False
+
+    dtype = getattr(torch, Config.EXPORT_DTYPE, None)
+    if not isinstance(dtype, torch.dtype):
+        logging.error(f"Invalid EXPORT_DTYPE: {Config.EXPORT_DTYPE}")
+        return False
+
+    # Merge in float32 so the LoRA update is not rounded twice
+    logging.info(f"Loading base model: {Config.BASE_MODEL}")
+    model = AutoModelForCausalLM.from_pretrained(
+        Config.BASE_MODEL, torch_dtype=torch.float32, low_cpu_mem_usage=True)
+    logging.info(f"Merging adapter from: {Config.MODEL_PATH}")
+    model = PeftModel.from_pretrained(model, Config.MODEL_PATH).merge_and_unload()
+    model.to(dtype)
+
+    logging.info(f"Saving merged {Config.EXPORT_DTYPE} model to {Config.MERGED_MODEL_PATH}")
+    os.makedirs(Config.MERGED_MODEL_PATH, exist_ok=True)
+    model.save_pretrained(Config.MERGED_MODEL_PATH, safe_serialization=True)
+    AutoTokenizer.from_pretrained(Config.MODEL_PATH).save_pretrained(Config.MERGED_MODEL_PATH)
+    save_json({
+        "base_model": Config.BASE_MODEL,
+        "adapter_path": Config.MODEL_PATH,
+        "adapter_sha256": digest,
+        "dtype": Config.EXPORT_DTYPE
+    }, os.path.join(Config.MERGED_MODEL_PATH, EXPORT_STATE_FILE))
+    logging.info("Export complete!")
+    return True
+
+
+if __name__ == '__main__':
+    export_model()
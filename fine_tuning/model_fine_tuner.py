@@ -1,31 +1,126 @@
 import logging
 import torch
-import json
+import math
 import os
-from transformers import AutoModelForCausalLM, AutoTokenizer, TrainingArguments, BitsAndBytesConfig
-from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
+import shutil
+from itertools import islice
+import numpy as np
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from peft import LoraConfig, PeftModel, get_peft_model, prepare_model_for_kbit_training
 from transformers import DataCollatorForSeq2Seq
-from trl import SFTTrainer
+from transformers.trainer_utils import get_last_checkpoint
+from trl import SFTConfig, SFTTrainer
 from config.config import Config
-from datasets import Dataset
+from fine_tuning.metrics import TrainingMetrics
+from fine_tuning.packing import PackedDataCollator, log_tokens_per_step, padded_lengths
+from fine_tuning.streaming import StreamingMessages
+from fine_tuning.token_cache import TokenCache, hash_file_prefix
+from utils.utils import get_timestamp, load_json, save_json
+
+TRAINING_STATE_FILE = "training_state.json"
+CHECKPOINTS_DIR = "checkpoints"
 
 logging.basicConfig(level=logging.INFO)
 
 
-def train_model():
+def cpu_supports_bf16():
+    """Check whether the CPU has native bf16 instructions (AVX512-BF16 or AMX)"""
+    for check in ("_is_avx512_bf16_supported", "_is_amx_tile_supported"):
+        supported = getattr(torch.cpu, check, None)
+        if supported is not None and supported():
+            return True
+    return False
+
+
+def load_training_state():
+    """Load the state of the last training run, if there was one"""
+    path = os.path.join(Config.MODEL_PATH, TRAINING_STATE_FILE)
+    if not os.path.exists(path):
+        return None
+    return load_json(path)
+
+
+def plan_training_run(cache, state, continual):
+    """Decide which cached messages a new training run trains on
+
+    A full run trains on every message from scratch. A continual run keeps
+    training the existing adapter on the messages added since the last
+    completed run. Returns None if a continual run has nothing new to train.
+    """
+    first_message = 0
+    if continual and not os.path.exists(os.path.join(Config.MODEL_PATH, "adapter_config.json")):
+        logging.warning(f"No adapter in {Config.MODEL_PATH} to continue from, training from scratch")
+        continual = False
+    elif continual and not (state and state["completed"]):
+        logging.warning("No completed training run to continue from, training on every message")
+    elif continual and (os.path.getsize(Config.DATASET_PATH) < state["dataset_bytes"] or
+                        hash_file_prefix(Config.DATASET_PATH, state["dataset_bytes"]).hexdigest()
+                        != state["dataset_sha256"]):
+        logging.warning("The dataset was rebuilt since the last training run, training on every message")
+    elif continual:
+        first_message = state["messages"]
+
+    if continual and first_message >= len(cache):
+        logging.info("No new messages since the last training run")
+        return None
+
+    # Each run saves its checkpoints to its own directory, so an interrupted
+    # run never resumes from an earlier run's checkpoints
+    checkpoints = os.path.join(Config.MODEL_PATH, CHECKPOINTS_DIR)
+    if os.path.isdir(checkpoints):
+        shutil.rmtree(checkpoints)
+
+    return {
+        "completed": False,
+        "checkpoint_dir": os.path.join(checkpoints, f"run_{get_timestamp()}"),
+        "continual": continual,
+        "first_message": first_message,
+        "messages": len(cache),
+        "dataset_bytes": cache.manifest["dataset_bytes"],
+        "dataset_sha256": cache.manifest["dataset_sha256"]
+    }
+
+
+def run_shards(cache, run):
+    """Token cache shards holding the messages a training run trains on"""
+    starts = cache.shard_starts
+    first = int(np.searchsorted(starts, run["first_message"], side='right')) - 1
+    if starts[first] != run["first_message"]:
+        logging.warning(f"Message {run['first_message']} is not at a token cache shard boundary, "
+                        f"continuing from message {starts[first]} instead")
+    return [shard for shard in range(first, len(cache.shards)) if starts[shard] < run["messages"]]
+
+
+def train_model(continual=False):
     # Disable wandb
     os.environ["WANDB_DISABLED"] = "true"
 
     logging.info("Starting model fine-tuning with PEFT/LoRA")
 
-    # Check if GPU is available
-    device = "cuda" if torch.cuda.is_available() else "cpu"
+    # Pick the training profile, falling back to CPU training without a GPU
+    Config.apply_training_profile()
+    if not Config.USE_CPU and not torch.cuda.is_available():
+        logging.warning("CUDA is not available, falling back to the cpu training profile")
+        Config.apply_training_profile('cpu')
+    logging.info(f"Using training profile: {Config.TRAINING_PROFILE}")
+
+    device = "cpu" if Config.USE_CPU else "cuda"
     logging.info(f"Using device: {device}")
+    if Config.USE_CPU and Config.CPU_THREADS:
+        torch.set_num_threads(Config.CPU_THREADS)
 
-    # Determine precision
-    use_4bit = Config.LOAD_IN_4BIT
-    use_bf16 = torch.cuda.is_available(
-    ) and torch.cuda.get_device_capability()[0] >= 8
+    # Determine precision. On CPU the weights stay in float32 and bf16 is
+    # only used through autocast
+    use_4bit = Config.LOAD_IN_4BIT and not Config.USE_CPU
+    if Config.USE_CPU:
+        use_bf16 = cpu_supports_bf16() if Config.CPU_BF16 == 'auto' else Config.CPU_BF16 == 'true'
+        use_fp16 = False
+        torch_dtype = torch.float32
+        logging.info(f"Training on {torch.get_num_threads()} CPU threads, bf16 autocast: {use_bf16}")
+    else:
+        use_bf16 = torch.cuda.get_device_capability()[0] >= 8
+        use_fp16 = not use_bf16
+        torch_dtype = torch.bfloat16 if use_bf16 else torch.float16
 
     logging.info(f"Loading model: {Config.BASE_MODEL}")
 
@@ -43,9 +138,9 @@ def train_model():
     # Load base model and tokenizer
     model = AutoModelForCausalLM.from_pretrained(
         Config.BASE_MODEL,
-        device_map="auto",
+        device_map=None if Config.USE_CPU else "auto",
         quantization_config=quantization_config,
-        torch_dtype=torch.bfloat16 if use_bf16 else torch.float16,
+        torch_dtype=torch_dtype,
     )
 
     # Load tokenizer
@@ -63,6 +158,28 @@ def train_model():
     if use_4bit:
         model = prepare_model_for_kbit_training(model)
 
+    # Tokenize only the messages added since the last run, the rest is
+    # memory-mapped from the token cache
+    if not os.path.exists(Config.DATASET_PATH):
+        logging.error(f"Dataset {Config.DATASET_PATH} not found, run 'python main.py format' first")
+        return False
+    logging.info(f"Loading dataset from {Config.DATASET_PATH}")
+    cache = TokenCache(tokenizer)
+    cache.update(Config.DATASET_PATH)
+
+    # Resume an interrupted run, otherwise plan a new one
+    state = load_training_state()
+    checkpoint = None
+    if state and not state["completed"] and os.path.isdir(state.get("checkpoint_dir", "")):
+        checkpoint = get_last_checkpoint(state["checkpoint_dir"])
+    if checkpoint:
+        logging.info(f"Resuming interrupted training from {checkpoint}")
+        run = state
+    else:
+        run = plan_training_run(cache, state, continual)
+        if run is None:
+            return True
+
     # Configure LoRA
     logging.info("Applying LoRA adapters")
     lora_config = LoraConfig(
@@ -75,74 +192,112 @@ def train_model():
         task_type="CAUSAL_LM"
     )
 
-    # Apply LoRA adapters
-    model = get_peft_model(model, lora_config)
+    # Apply LoRA adapters, or keep training the existing adapter
+    if run["continual"]:
+        logging.info(f"Loading adapter from {Config.MODEL_PATH}")
+        model = PeftModel.from_pretrained(model, Config.MODEL_PATH, is_trainable=True)
+    else:
+        model = get_peft_model(model, lora_config)
     model.print_trainable_parameters()
 
-    # Load and format dataset
-    logging.info("Loading dataset")
-    with open('data/formatted_logs/dataset.json', 'r') as f:
-        messages = json.load(f)
+    # Stream examples from the memory-mapped shards instead of loading the
+    # whole dataset into memory. A continual run trains on the new shards,
+    # mixed with a replay sample of older messages
+    shards = run_shards(cache, run)
+    replay_ratio = Config.REPLAY_RATIO if run["continual"] else 0
+    train_dataset = StreamingMessages(cache, tokenizer.eos_token_id, shards=shards, replay_ratio=replay_ratio)
+    data_collator = PackedDataCollator(tokenizer.pad_token_id) if Config.PACK_SEQUENCES \
+        else DataCollatorForSeq2Seq(tokenizer, model=model)
 
-    dataset = Dataset.from_list([{"text": msg} for msg in messages])
+    # Estimate tokens per step from the start of the stream
+    sequences_per_step = Config.BATCH_SIZE * Config.GRADIENT_ACCUMULATION_STEPS
+    for pack in sorted({False, Config.PACK_SEQUENCES}):
+        sample = StreamingMessages(cache, tokenizer.eos_token_id, pack=pack,
+                                   shards=shards, replay_ratio=replay_ratio)
+        lengths = [len(example["input_ids"]) for example in islice(sample, sequences_per_step * 100)]
+        log_tokens_per_step("Packed" if pack else "Unpacked", lengths,
+                            padded_lengths(lengths, Config.BATCH_SIZE), sequences_per_step)
 
-    def tokenize_function(examples):
-        return tokenizer(
-            examples["text"],
-            padding=True,
-            truncation=True,
-            max_length=Config.MAX_SEQ_LENGTH,
-            return_tensors="pt"
-        )
+    if "max_steps" not in run:
+        run["max_steps"] = Config.TRAINING_STEPS
+        if run["continual"]:
+            # One pass over the new messages and their replay sample
+            steps = math.ceil(train_dataset.epoch_examples() / sequences_per_step)
+            run["max_steps"] = max(1, min(steps, Config.TRAINING_STEPS))
+    logging.info(f"Training for {run['max_steps']} steps on messages "
+                 f"{run['first_message']} to {run['messages']}, replay ratio {replay_ratio}")
 
-    # Tokenize the dataset
-    tokenized_dataset = dataset.map(
-        tokenize_function,
-        batched=True,
-        remove_columns=dataset.column_names
-    )
+    if checkpoint:
+        # Skip the examples the checkpoint already trained on without reading them
+        trainer_state = load_json(os.path.join(checkpoint, "trainer_state.json"))
+        train_dataset.load_state_dict({"position": trainer_state["global_step"] * sequences_per_step})
+
+    os.makedirs(Config.MODEL_PATH, exist_ok=True)
+    save_json(run, os.path.join(Config.MODEL_PATH, TRAINING_STATE_FILE))
 
     # Set up training arguments
     logging.info("Configuring trainer")
-    training_args = TrainingArguments(
+    training_args = SFTConfig(
         per_device_train_batch_size=Config.BATCH_SIZE,
         gradient_accumulation_steps=Config.GRADIENT_ACCUMULATION_STEPS,
         warmup_steps=Config.WARMUP_STEPS,
-        max_steps=Config.TRAINING_STEPS,
+        max_steps=run["max_steps"],
         learning_rate=Config.LEARNING_RATE,
-        fp16=not use_bf16,
+        fp16=use_fp16,
         bf16=use_bf16,
+        use_cpu=Config.USE_CPU,
         logging_steps=1,
         optim="adamw_torch",  # Using standard optimizer for Windows compatibility
         weight_decay=Config.WEIGHT_DECAY,
-        output_dir=Config.MODEL_PATH,
+        output_dir=run["checkpoint_dir"],
         save_strategy="steps",
-        save_steps=50,
+        save_steps=Config.SAVE_STEPS,
         save_total_limit=3,
         report_to=[],  # Disable all reporting
         run_name=None,  # Prevent wandb name collision warning
-        gradient_checkpointing=True,  # Add this line
+        gradient_checkpointing=not Config.USE_CPU,  # Saves GPU memory, only slows CPU training down
+        dataloader_pin_memory=not Config.USE_CPU,
+        max_seq_length=Config.MAX_SEQ_LENGTH,
+        dataset_kwargs={"skip_prepare_dataset": True},  # Already tokenized by the token cache
+        ignore_data_skip=True,  # The dataset skips ahead itself when resuming
     )
 
+    # Record step times, token throughput and memory under logs/
+    metrics = TrainingMetrics(run_config={
+        "profile": Config.TRAINING_PROFILE,
+        "pack_sequences": Config.PACK_SEQUENCES,
+        "batch_size": Config.BATCH_SIZE,
+        "gradient_accumulation_steps": Config.GRADIENT_ACCUMULATION_STEPS,
+        "max_seq_length": Config.MAX_SEQ_LENGTH,
+        "precision": "bf16" if use_bf16 else "fp16" if use_fp16 else "fp32",
+        "device": "cpu" if Config.USE_CPU else "cuda",
+        "max_steps": run["max_steps"]
+    })
+
     # Configure SFT trainer
     trainer = SFTTrainer(
         model=model,
         args=training_args,
-        data_collator=DataCollatorForSeq2Seq(tokenizer, model=model),
-        train_dataset=tokenized_dataset,
+        data_collator=metrics.wrap_collator(data_collator),
+        train_dataset=train_dataset,
         peft_config=lora_config,
-        formatting_func=lambda x: x['content'],
+        callbacks=[metrics],
     )
 
     # Train model
     logging.info("Starting training")
-    trainer.train()
+    trainer.train(resume_from_checkpoint=checkpoint)
 
     # Save model
     logging.info(f"Saving model to {Config.MODEL_PATH}")
     model.save_pretrained(Config.MODEL_PATH)
     tokenizer.save_pretrained(Config.MODEL_PATH)
+    run["completed"] = True
+    run["global_step"] = trainer.state.global_step
+    save_json(run, os.path.join(Config.MODEL_PATH, TRAINING_STATE_FILE))
+    shutil.rmtree(run["checkpoint_dir"], ignore_errors=True)
     logging.info("Fine-tuning complete!")
+    return True
 
 
 if __name__ == '__main__':
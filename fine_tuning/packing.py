@@ -0,0 +1,71 @@
+import logging
+
+import torch
+
+
+class PackedDataCollator:
+    """Collate packed sequences so messages cannot attend to each other
+
+    Builds a 4D block-diagonal causal mask from the position id resets and
+    stops the last token of one message from being trained to predict the
+    first token of the next.
+    """
+
+    def __init__(self, pad_token_id, dtype=torch.float32):
+        """Initialize the packed data collator"""
+        self.pad_token_id = pad_token_id
+        self.dtype = dtype
+
+    def __call__(self, features):
+        length = max(len(feature["input_ids"]) for feature in features)
+        batch_size = len(features)
+
+        input_ids = torch.full((batch_size, length), self.pad_token_id, dtype=torch.long)
+        position_ids = torch.zeros((batch_size, length), dtype=torch.long)
+        labels = torch.full((batch_size, length), -100, dtype=torch.long)
+        segments = torch.zeros((batch_size, length), dtype=torch.long)  # Padding is segment 0
+
+        for row, feature in enumerate(features):
+            ids = torch.tensor(feature["input_ids"], dtype=torch.long)
+            positions = torch.tensor(feature["position_ids"], dtype=torch.long)
+            starts = positions == 0
+            size = len(ids)
+
+            input_ids[row, :size] = ids
+            position_ids[row, :size] = positions
+            labels[row, :size] = ids
+            labels[row, :size][starts] = -100
+            segments[row, :size] = torch.cumsum(starts, dim=0)
+
+        # Attend only to earlier tokens of the same message
+        causal = torch.ones((length, length), dtype=torch.bool).tril()
+        allowed = (segments[:, :, None] == segments[:, None, :]) & causal
+        attention_mask = torch.zeros((batch_size, 1, length, length), dtype=self.dtype)
+        attention_mask.masked_fill_(~allowed[:, None], torch.finfo(self.dtype).min)
+
+        return {
+            "input_ids": input_ids,
+            "position_ids": position_ids,
+            "attention_mask": attention_mask,
+            "labels": labels
+        }
+
+
+def padded_lengths(lengths, batch_size):
+    """Row lengths once consecutive batches are padded to their longest row"""
+    padded = []
+    for i in range(0, len(lengths), batch_size):
+        chunk = lengths[i:i + batch_size]
+        padded.extend([max(chunk)] * len(chunk))
+    return padded
+
+
+def log_tokens_per_step(label, real_lengths, padded_lengths, sequences_per_step):
+    """Log the real and padded tokens an optimizer step trains on"""
+    if not real_lengths:
+        return
+    real = sum(real_lengths) / len(real_lengths) * sequences_per_step
+    padded = sum(padded_lengths) / len(padded_lengths) * sequences_per_step
+    logging.info(
+        f"{label}: {len(real_lengths)} sequences, {real:,.0f} real tokens/step, "
+        f"{padded:,.0f} padded tokens/step ({real / padded:.1%} real)")
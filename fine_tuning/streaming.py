@@ -0,0 +1,167 @@
+import random
+
+import torch
+
+from config.config import Config
+
+SHUFFLE_BLOCK_MESSAGES = 1024  # Consecutive messages read together before the shuffle buffer
+
+
+class StreamingMessages(torch.utils.data.IterableDataset):
+    """Stream training examples from the token cache shards
+
+    Only message indices are held in memory: each shard is walked in a
+    shuffled order of fixed size blocks, shards are interleaved, and a
+    shuffle buffer mixes the result. Token ids are read from the
+    memory-mapped shards as examples are yielded, so memory use does not
+    grow with the corpus.
+
+    The order is fully determined by the seed, so training can resume
+    from ``position``, the number of examples yielded so far, without
+    reading the skipped examples' tokens.
+
+    With ``recency_weight`` above 1, each newer shard is sampled that many
+    times more often per message than the one before it, and shards are
+    drawn with replacement. Otherwise every message is seen once per epoch.
+
+    ``shards`` limits training to some of the shards. With a
+    ``replay_ratio``, that many examples per trained message are mixed in,
+    drawn uniformly from the shards before them.
+    """
+
+    def __init__(self, cache, eos_token_id, pack=None, max_length=None, shuffle_buffer=None,
+                 recency_weight=None, shards=None, replay_ratio=0, seed=42):
+        """Initialize the streaming dataset"""
+        self.cache = cache
+        self.eos_token_id = eos_token_id
+        self.pack = Config.PACK_SEQUENCES if pack is None else pack
+        self.max_length = max_length or cache.max_length
+        self.shuffle_buffer = shuffle_buffer or Config.SHUFFLE_BUFFER_SIZE
+        self.recency_weight = recency_weight or Config.RECENCY_WEIGHT
+        self.seed = seed
+        self.position = 0
+        self.sizes = [len(offsets) - 1 for _, offsets in cache.shards]
+        self.shards = list(range(len(self.sizes))) if shards is None else list(shards)
+        self.replay_shards = [shard for shard in range(min(self.shards, default=0)) if self.sizes[shard]]
+        self.replay_ratio = replay_ratio
+
+    def state_dict(self):
+        return {"position": self.position, "seed": self.seed}
+
+    def load_state_dict(self, state):
+        self.position = state["position"]
+        self.seed = state.get("seed", self.seed)
+
+    def _iter_shard(self, rng, shard):
+        """Yield a shard's message indices in shuffled block order, forever"""
+        size = self.sizes[shard]
+        while True:
+            blocks = list(range(0, size, SHUFFLE_BLOCK_MESSAGES))
+            rng.shuffle(blocks)
+            for start in blocks:
+                yield from range(start, min(start + SHUFFLE_BLOCK_MESSAGES, size))
+
+    def _iter_epoch(self, epoch):
+        """Yield (shard, message) indices for one epoch"""
+        rng = random.Random(f"{self.seed}:{epoch}")
+        cursors = {shard: self._iter_shard(rng, shard) for shard in self.shards}
+
+        if self.recency_weight == 1:
+            # Draw in proportion to what is left, so each message is seen once
+            weights = [self.sizes[shard] for shard in self.shards]
+        else:
+            weights = [self.sizes[shard] * self.recency_weight ** shard for shard in self.shards]
+
+        new_left = sum(self.sizes[shard] for shard in self.shards)
+        replay_weights = [self.sizes[shard] for shard in self.replay_shards]
+        replay_left = round(new_left * self.replay_ratio) if self.replay_shards else 0
+
+        buffer = []
+        for _ in range(new_left + replay_left):
+            if rng.random() * (new_left + replay_left) < replay_left:
+                replay_left -= 1
+                shard = rng.choices(self.replay_shards, weights=replay_weights)[0]
+                item = (shard, rng.randrange(self.sizes[shard]))
+            else:
+                new_left -= 1
+                k = rng.choices(range(len(self.shards)), weights=weights)[0]
+                if self.recency_weight == 1:
+                    weights[k] -= 1
+                shard = self.shards[k]
+                item = (shard, next(cursors[shard]))
+
+            if len(buffer) < self.shuffle_buffer:
+                buffer.append(item)
+                continue
+            i = rng.randrange(len(buffer))
+            yield buffer[i]
+            buffer[i] = item
+
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _length(self, shard, i):
+        """Tokens a message takes up in a training example"""
+        offsets = self.cache.shards[shard][1]
+        length = int(offsets[i + 1] - offsets[i])
+        return min(length, self.max_length - 1) + 1 if self.pack else length
+
+    def _iter_epoch_groups(self, epoch):
+        """Yield the messages of each training example in one epoch"""
+        if not self.pack:
+            for item in self._iter_epoch(epoch):
+                yield [item]
+            return
+
+        # Greedily pack consecutive messages up to max_length tokens
+        group, used = [], 0
+        for item in self._iter_epoch(epoch):
+            length = self._length(*item)
+            if group and used + length > self.max_length:
+                yield group
+                group, used = [], 0
+            group.append(item)
+            used += length
+        if group:
+            yield group
+
+    def _iter_groups(self):
+        """Yield the messages of each training example, epoch after epoch"""
+        epoch = 0
+        while True:
+            yield from self._iter_epoch_groups(epoch)
+            epoch += 1
+
+    def epoch_examples(self):
+        """Count the examples in an epoch without reading any tokens"""
+        return sum(1 for _ in self._iter_epoch_groups(0))
+
+    def _example(self, group):
+        """Read the token ids of a group of messages into a training example"""
+        if not self.pack:
+            shard, i = group[0]
+            tokens, offsets = self.cache.shards[shard]
+            input_ids = tokens[offsets[i]:offsets[i + 1]].tolist()
+            return {"input_ids": input_ids, "attention_mask": [1] * len(input_ids), "labels": list(input_ids)}
+
+        input_ids, position_ids = [], []
+        for shard, i in group:
+            tokens, offsets = self.cache.shards[shard]
+            ids = tokens[offsets[i]:offsets[i + 1]].tolist()
+            if not ids or ids[-1] != self.eos_token_id:
+                ids = ids[:self.max_length - 1] + [self.eos_token_id]
+            input_ids.extend(ids)
+            position_ids.extend(range(len(ids)))
+        return {"input_ids": input_ids, "position_ids": position_ids}
+
+    def __iter__(self):
+        if not sum(self.sizes[shard] for shard in self.shards):
+            return
+
+        groups = self._iter_groups()
+        for _ in range(self.position):
+            next(groups)
+
+        for group in groups:
+            self.position += 1
+            yield self._example(group)
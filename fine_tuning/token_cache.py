@@ -0,0 +1,184 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from config.config import Config
+from utils.utils import load_json, save_json
+
+TOKENIZE_BATCH_SIZE = 10000  # Messages tokenized per tokenizer call
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Hash everything about a tokenizer that changes the ids it produces"""
+    digest = hashlib.sha256(type(tokenizer).__name__.encode())
+    if tokenizer.is_fast:
+        # Padding and truncation settings change with every call, leave them out
+        state = json.loads(tokenizer.backend_tokenizer.to_str())
+        state.pop("padding", None)
+        state.pop("truncation", None)
+        digest.update(json.dumps(state, sort_keys=True).encode())
+    else:
+        digest.update(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode())
+    digest.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+def hash_file_prefix(path, size):
+    """Hash the first ``size`` bytes of a file, returning the running hash"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        remaining = size
+        while remaining > 0:
+            chunk = f.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest
+
+
+def iter_dataset_lines(path, offset):
+    """Yield each complete raw line of the dataset after byte ``offset``
+
+    A line still being appended (no trailing newline yet) is left for the
+    next run.
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            yield line
+
+
+class TokenCache:
+    """Pre-tokenized dataset shards that are memory-mapped at training time
+
+    Shards live in a directory keyed by the tokenizer and MAX_SEQ_LENGTH.
+    Each shard holds the token ids of its messages back to back, plus the
+    offsets where each message starts. The cache records how many bytes of
+    the dataset it covers and their hash: appended messages are tokenized
+    into new shards, and a dataset that was rebuilt or edited is tokenized
+    again from scratch.
+    """
+
+    def __init__(self, tokenizer, cache_dir=None, max_length=None):
+        """Initialize the token cache"""
+        self.tokenizer = tokenizer
+        self.max_length = max_length or Config.MAX_SEQ_LENGTH
+        key = hashlib.sha256(
+            f"{tokenizer_fingerprint(tokenizer)}:{self.max_length}".encode()).hexdigest()[:16]
+        self.path = Path(cache_dir or Config.TOKEN_CACHE_DIR) / key
+        self.manifest_path = self.path / 'manifest.json'
+        self.manifest = None
+        self.shards = []
+        self.shard_starts = np.zeros(1, dtype=np.int64)  # Index of each shard's first message
+
+    def _load_manifest(self, dataset_path):
+        """Load the manifest and the running hash of the dataset prefix it covers
+
+        Returns (None, None) if the cache does not describe a prefix of the
+        current dataset.
+        """
+        if not self.manifest_path.exists():
+            return None, None
+
+        manifest = load_json(self.manifest_path)
+        if not manifest or manifest.get("dataset") != str(dataset_path):
+            return None, None
+
+        for shard in manifest["shards"]:
+            if not (self.path / f"{shard['name']}_tokens.npy").exists():
+                logging.warning(f"Token cache shard {shard['name']} is missing, rebuilding the token cache")
+                return None, None
+
+        if os.path.getsize(dataset_path) >= manifest["dataset_bytes"]:
+            digest = hash_file_prefix(dataset_path, manifest["dataset_bytes"])
+            if digest.hexdigest() == manifest["dataset_sha256"]:
+                return manifest, digest
+
+        logging.info("Dataset changed since it was tokenized, rebuilding the token cache")
+        return None, None
+
+    def _write_shard(self, name, token_ids):
+        """Save one shard of tokenized messages"""
+        offsets = np.zeros(len(token_ids) + 1, dtype=np.int64)
+        np.cumsum([len(ids) for ids in token_ids], out=offsets[1:])
+        tokens = np.fromiter((token for ids in token_ids for token in ids),
+                             dtype=np.int32, count=int(offsets[-1]))
+
+        # Write under temporary names so a crash never leaves a torn shard
+        for suffix, array in (("tokens", tokens), ("offsets", offsets)):
+            partial_path = self.path / f"{name}_{suffix}.part.npy"
+            np.save(partial_path, array)
+            os.replace(partial_path, self.path / f"{name}_{suffix}.npy")
+
+        return {"name": name, "messages": len(token_ids), "tokens": int(offsets[-1])}
+
+    def update(self, dataset_path=None):
+        """Tokenize whatever part of the dataset is not cached yet"""
+        dataset_path = dataset_path or Config.DATASET_PATH
+        manifest, digest = self._load_manifest(dataset_path)
+        if manifest is None:
+            shutil.rmtree(self.path, ignore_errors=True)
+            manifest = {"dataset": str(dataset_path), "dataset_bytes": 0,
+                        "dataset_sha256": None, "shards": []}
+            digest = hashlib.sha256()
+        os.makedirs(self.path, exist_ok=True)
+
+        offset = manifest["dataset_bytes"]
+        texts, token_ids = [], []
+        added = 0
+
+        def flush_shard():
+            name = f"{len(manifest['shards']):04d}"
+            manifest["shards"].append(self._write_shard(name, token_ids))
+            manifest["dataset_bytes"] = offset
+            manifest["dataset_sha256"] = digest.hexdigest()
+            save_json(manifest, self.manifest_path)
+            token_ids.clear()
+
+        for line in iter_dataset_lines(dataset_path, offset):
+            digest.update(line)
+            offset += len(line)
+            try:
+                texts.append(json.loads(line)["text"])
+            except (json.JSONDecodeError, KeyError, TypeError):
+                logging.warning(f"Skipping malformed line ending at byte {offset} in {dataset_path}")
+
+            if len(texts) >= TOKENIZE_BATCH_SIZE:
+                token_ids.extend(self._tokenize(texts))
+                added += len(texts)
+                texts = []
+                if len(token_ids) >= Config.TOKEN_CACHE_SHARD_MESSAGES:
+                    flush_shard()
+
+        if texts:
+            token_ids.extend(self._tokenize(texts))
+            added += len(texts)
+        if token_ids:
+            flush_shard()
+
+        self.manifest = manifest
+        self.shards = [self._open_shard(shard) for shard in manifest["shards"]]
+        self.shard_starts = np.cumsum([0] + [shard["messages"] for shard in manifest["shards"]])
+        logging.info(f"Token cache {self.path}: {added} new messages tokenized, "
+                     f"{len(self)} messages in {len(self.shards)} shards")
+        return added
+
+    def _tokenize(self, texts):
+        """Tokenize a batch of messages without padding"""
+        return self.tokenizer(texts, truncation=True, max_length=self.max_length)["input_ids"]
+
+    def _open_shard(self, shard):
+        """Memory-map a shard's token ids and offsets"""
+        return (np.load(self.path / f"{shard['name']}_tokens.npy", mmap_mode='r'),
+                np.load(self.path / f"{shard['name']}_offsets.npy", mmap_mode='r'))
+
+    def __len__(self):
+        return int(self.shard_starts[-1])
@@ -1,19 +1,28 @@
 import argparse
 import asyncio
+import logging
 import sys
 
+from config.config import Config
 from utils.dataset_formatter import format_dataset
+from fine_tuning.model_exporter import export_model
 from fine_tuning.model_fine_tuner import train_model
-from twitch.chatter_bot import TwitchBot
+from twitch.chatter_bot import ChatMessageGenerator, TwitchBot
+from twitch.inference_server import InferenceServer
 from utils.auto_chat_recorder import main as auto_chat_recorder_main
 
 
-def run_dataset_formatter():
-    format_dataset()
+def run_dataset_formatter(rebuild=False):
+    format_dataset(rebuild=rebuild)
+
 
+def run_model_fine_tuner(continual=False):
+    train_model(continual=continual)
 
-def run_model_fine_tuner():
-    train_model()
+
+def run_model_exporter():
+    if not export_model():
+        sys.exit(1)
 
 
 async def run_bot():
@@ -21,15 +30,37 @@ async def run_bot():
     await bot.start()
 
 
+def run_inference_server():
+    InferenceServer(ChatMessageGenerator).run()
+
+
 async def run_auto_chat_recorder():
     await auto_chat_recorder_main()
 
 
+def run_smoke_test():
+    """Format, train and export a tiny model, then generate a message, all on CPU"""
+    Config.apply_training_profile('smoke')
+    format_dataset()
+    if not train_model():
+        logging.error("Smoke test failed: training did not complete")
+        sys.exit(1)
+    if not export_model():
+        logging.error("Smoke test failed: export did not complete")
+        sys.exit(1)
+
+    message = ChatMessageGenerator().generate()
+    logging.info(f"Smoke test passed, generated message: {message!r}")
+
+
 # Run the script with the following arguments:
 # python main.py <script>
 # train = model_fine_tuner
 # bot = twitch_bot
 # auto = auto_chat_recorder
+# export = merge the adapter into the base model for the bot
+# serve = shared inference server for bots with INFERENCE_SERVER_URL set
+# smoke = format, train, export and generate with a tiny model on CPU
 
 
 def main():
@@ -37,20 +68,37 @@ def main():
         description="Run various project scripts.")
     parser.add_argument(
         "script",
-        choices=["train", "bot", "auto", "format"],
+        choices=["train", "bot", "auto", "format", "export", "serve", "smoke"],
         help="Choose which script to run."
     )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Regenerate the dataset from every chat log (format only)."
+    )
+    parser.add_argument(
+        "--continual",
+        action="store_true",
+        help="Keep training the existing adapter on new messages only (train only)."
+    )
 
     args = parser.parse_args()
+    Config.apply_training_profile()
 
     if args.script == "train":
-        run_model_fine_tuner()
+        run_model_fine_tuner(continual=args.continual)
     elif args.script == "format":
-        run_dataset_formatter()
+        run_dataset_formatter(rebuild=args.rebuild)
+    elif args.script == "export":
+        run_model_exporter()
+    elif args.script == "serve":
+        run_inference_server()
     elif args.script == "bot":
         asyncio.run(run_bot())
     elif args.script == "auto":
         asyncio.run(run_auto_chat_recorder())
+    elif args.script == "smoke":
+        run_smoke_test()
     else:
         print("Invalid script choice.")
         sys.exit(1)
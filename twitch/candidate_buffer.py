@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from itertools import count
+
+from config.config import Config
+from utils.dataset_formatter import collapse_repetition, simhash
+
+
+def word_variety(message):
+    """Share of a message's words that are distinct, ignoring case"""
+    words = message.lower().split()
+    return len(set(words)) / len(words) if words else 0.0
+
+
+class CandidateBuffer:
+    """Keep a ranked buffer of generated messages ready to send
+
+    Whenever the buffer has room, a background producer samples
+    ``batch_size`` candidates in one batched generate call on the inference
+    worker, or on the inference server in client mode. A phrase repeated
+    back to back more than CANDIDATE_MAX_REPEATS times is collapsed, so
+    "LUL LUL LUL" survives but a generation stuck in a loop is cut short.
+    Candidates that are too short or too long, or nearly duplicate a
+    recently taken or already buffered message, are dropped. The rest are
+    ranked by word variety, and ``take`` pops the best one, so sending a
+    message does not wait for the model.
+
+    ``prompt`` returns the prompt token ids for the next batch, or None for
+    the generator's fixed prompt. Candidates older than ``max_age`` seconds
+    are discarded, so replies to a chat window do not go stale.
+    """
+
+    def __init__(self, worker, size=None, batch_size=None, prompt=None, max_age=None):
+        """Initialize the candidate buffer"""
+        self.worker = worker
+        self.size = size or Config.CANDIDATE_BUFFER_SIZE
+        self.batch_size = batch_size or Config.CANDIDATES_PER_BATCH
+        self.prompt = prompt
+        self.max_age = max_age
+        self.ready = []  # (-score, order, message, fingerprint, created), best first
+        self.order = count()
+        self.recent = deque(maxlen=Config.RECENT_MESSAGES)  # Fingerprints of taken messages
+        self.condition = asyncio.Condition()
+        self.stats = {
+            "batches": 0,
+            "generated": 0,
+            "kept": 0,
+            "rejected_length": 0,
+            "collapsed_repetition": 0,
+            "rejected_duplicate": 0,
+            "expired": 0,
+            "taken": 0,
+            "take_wait": 0.0,  # Total seconds take waited for a candidate
+        }
+
+    def _is_duplicate(self, fingerprint):
+        fingerprints = list(self.recent) + [item[3] for item in self.ready]
+        return any(bin(fingerprint ^ other).count('1') <= Config.DEDUP_SIMHASH_DISTANCE for other in fingerprints)
+
+    def _add(self, message, created):
+        """Rank a candidate into the buffer unless it is filtered out"""
+        collapsed = collapse_repetition(message, max_repeats=Config.CANDIDATE_MAX_REPEATS)
+        if collapsed is not message:
+            self.stats["collapsed_repetition"] += 1
+            message = collapsed
+        if not Config.CANDIDATE_MIN_CHARS <= len(message) <= Config.CANDIDATE_MAX_CHARS:
+            self.stats["rejected_length"] += 1
+            return
+
+        fingerprint = simhash(message.lower())
+        if self._is_duplicate(fingerprint):
+            self.stats["rejected_duplicate"] += 1
+            return
+
+        self.ready.append((-word_variety(message), next(self.order), message, fingerprint, created))
+        self.stats["kept"] += 1
+
+    async def run(self):
+        """Top the buffer up with new candidates whenever it has room"""
+        while True:
+            async with self.condition:
+                self._expire()
+                while len(self.ready) >= self.size:
+                    # Wake up when candidates are taken or the oldest ones expire
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), timeout=self.max_age or None)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._expire()
+
+            try:
+                prompt_ids = self.prompt() if self.prompt else None
+                created = time.monotonic()
+                candidates = await self.worker.generate_candidates(self.batch_size, prompt_ids=prompt_ids)
+            except Exception as e:
+                logging.error(f"Error generating candidate messages: {e}")
+                await asyncio.sleep(10)
+                continue
+
+            async with self.condition:
+                self.stats["batches"] += 1
+                self.stats["generated"] += len(candidates)
+                for message in candidates:
+                    self._add(message, created)
+
+                # Keep only the best candidates if the batch overfilled the buffer
+                self.ready.sort()
+                del self.ready[self.size:]
+                self.condition.notify_all()
+
+            logging.info(f"Candidate buffer: {len(self.ready)}/{self.size} ready, "
+                         f"{self.stats['kept']} of {self.stats['generated']} candidates kept so far")
+
+    def _expire(self):
+        """Drop candidates older than max_age, returning whether any are left"""
+        if self.max_age:
+            cutoff = time.monotonic() - self.max_age
+            fresh = [item for item in self.ready if item[4] >= cutoff]
+            self.stats["expired"] += len(self.ready) - len(fresh)
+            self.ready = fresh
+        return bool(self.ready)
+
+    async def take(self):
+        """Pop the best ready message, waiting only if the buffer is empty"""
+        start = time.perf_counter()
+        async with self.condition:
+            await self.condition.wait_for(self._expire)
+            _, _, message, fingerprint, _ = self.ready.pop(0)
+            self.recent.append(fingerprint)
+            self.condition.notify_all()
+
+        self.stats["taken"] += 1
+        self.stats["take_wait"] += time.perf_counter() - start
+        return message
@@ -0,0 +1,65 @@
+import time
+from collections import deque
+
+from config.config import Config
+from utils.dataset_formatter import clean_message
+
+
+class ChatContext:
+    """Rolling window of recent chat messages, kept as prompt token ids
+
+    Each message is tokenized once, as one ``username: message`` line, when
+    it arrives. Messages leave the window when they are older than
+    ``max_age`` seconds or when the window would exceed ``max_tokens``, so
+    building a prompt only concatenates cached token ids.
+    """
+
+    PROMPT_PREFIX = "<|im_start|>user\nRecent chat:\n"
+    PROMPT_SUFFIX = "Say something interesting to chat<|im_end|>\n<|im_start|>assistant\n"
+
+    def __init__(self, tokenizer, max_tokens=None, max_age=None, max_message_tokens=None):
+        """Initialize the chat context"""
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens or Config.CHAT_CONTEXT_TOKENS
+        self.max_age = max_age or Config.CHAT_CONTEXT_SECONDS
+        self.max_message_tokens = max_message_tokens or Config.CHAT_CONTEXT_MESSAGE_TOKENS
+        self.prefix_ids = self._tokenize(self.PROMPT_PREFIX)
+        self.suffix_ids = self._tokenize(self.PROMPT_SUFFIX)
+        self.newline_ids = self._tokenize("\n")
+        self.messages = deque()  # (timestamp, token ids), oldest first
+        self.tokens = 0
+
+    def _tokenize(self, text):
+        return self.tokenizer(text, add_special_tokens=False)["input_ids"]
+
+    def add(self, username, message, timestamp=None):
+        """Tokenize a chat message into the window"""
+        message = clean_message(message)
+        if not message:
+            return
+
+        # Cut long messages but keep their newline, so the next line starts on its own
+        ids = self._tokenize(f"{username}: {message}")[:self.max_message_tokens - len(self.newline_ids)]
+        ids += self.newline_ids
+        self.messages.append((time.time() if timestamp is None else timestamp, ids))
+        self.tokens += len(ids)
+        self.expire(timestamp)
+
+    def expire(self, now=None):
+        """Drop the oldest messages until the window fits its age and token limits"""
+        cutoff = (time.time() if now is None else now) - self.max_age
+        while self.messages and (self.tokens > self.max_tokens or self.messages[0][0] < cutoff):
+            _, ids = self.messages.popleft()
+            self.tokens -= len(ids)
+
+    def prompt_ids(self, now=None):
+        """Token ids of a prompt with the current chat window"""
+        self.expire(now)
+        ids = list(self.prefix_ids)
+        for _, message_ids in self.messages:
+            ids.extend(message_ids)
+        ids.extend(self.suffix_ids)
+        return ids
+
+    def __len__(self):
+        return len(self.messages)
@@ -1,11 +1,14 @@
 from twitch.base import TwitchAPI
-from utils.utils import setup_logging, save_json, load_json, get_timestamp
+from twitch.irc import parse_frame
+from twitch.message_store import MessageStore
+from utils.chat_log_writer import ChatLogWriter
+from utils.utils import setup_logging, get_timestamp
 from config.config import Config
 import asyncio
 import logging
-import os
-import re
+import time
 import websockets
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import sys
 
@@ -16,50 +19,79 @@ sys.path.append(str(Path(__file__).resolve().parent))
 setup_logging()
 
 
+class ChannelSink:
+    """Message store and chat log writer for a single channel"""
+
+    def __init__(self, channel, timestamp):
+        """Initialize the channel sink"""
+        self.channel = channel
+
+        # Append chat log segments to the channel's data/chat_logs folder
+        self.writer = ChatLogWriter(
+            f"data/chat_logs/{channel}/recorded_chat_{timestamp}")
+
+        # Records the store spills on eviction wait here for the parser to
+        # queue them, so only the writer thread writes, in arrival order
+        self.spilled = []
+        self.messages = MessageStore(spill=self.spilled.extend)
+
+    def unsaved_count(self):
+        """Number of messages not yet handed to the writer"""
+        return len(self.spilled) + len(self.messages) - self.messages.saved
+
+    def take_unsaved(self):
+        """Take the spilled and unsaved records, oldest first, marking them saved"""
+        records = self.spilled + [message.to_record() for message in self.messages.unsaved()]
+        self.spilled.clear()
+        self.messages.mark_saved()
+        return records
+
+
 class TwitchChatReader:
-    """Class to read and save Twitch chat messages"""
+    """Class to read and save Twitch chat messages
+
+    A single reader may join several channels over its one connection, each
+    message is routed to the sink of the channel it was sent in.
+    """
 
-    def __init__(self, channel=None):
+    def __init__(self, channel=None, channels=None, join_limiter=None):
         """Initialize the Twitch chat reader"""
-        self.channel = channel or Config.TWITCH_CHANNEL
+        self.channels = [c.lower().lstrip("#") for c in channels or [channel or Config.TWITCH_CHANNEL]]
+        self.channel = self.channels[0]
         self.nickname = "justinfan12345"  # Anonymous connection
         self.irc_url = Config.TWITCH_IRC_URL
+        self.join_limiter = join_limiter
+        self.join_task = None
 
-        # Set fixed output file in data/chat_logs folder
-        self.output_file = f"data/chat_logs/recorded_chat_{get_timestamp()}.json"
-        self.messages = {}
+        timestamp = get_timestamp()
+        self.sinks = {channel: ChannelSink(channel, timestamp) for channel in self.channels}
         self.running = False
         self.websocket = None
         self.message_count = 0  # Number of messages read
         self.batch_size = 250  # Save every 250 messages
 
-        # Create chat_logs directory if it doesn't exist
-        os.makedirs("data/chat_logs", exist_ok=True)
-
-        # Load existing messages if the file exists
-        existing_data = load_json(self.output_file)
-        if existing_data:
-            # Clean up any existing messages with trailing characters
-            cleaned_data = {}
-            for username, message in existing_data.items():
-                cleaned_data[username] = message.rstrip(
-                    '\r\n ') if isinstance(message, str) else message
-
-            self.messages = cleaned_data
-            logging.info(
-                f"Loaded and cleaned {len(self.messages)} existing messages")
-
-        # Save the cleaned messages back to the file
-        if existing_data and self.messages != existing_data:
-            self.save_messages()
-            logging.info("Saved cleaned messages to file")
+        # Receive -> parse -> write pipeline
+        self.queue_size = Config.CHAT_READER_QUEUE_SIZE
+        self.overflow = Config.CHAT_READER_OVERFLOW
+        self.frame_queue = None
+        self.write_queue = None
+        self.executor = ThreadPoolExecutor(max_workers=1)  # Keeps writes in order
+        self.drained = None
+        self.stats = {
+            "frames_received": 0,
+            "frames_dropped": 0,  # Frames dropped because the parser fell behind
+            "messages_written": 0,
+            "queue_lag": 0.0,  # Seconds the last frame waited before parsing
+            "max_queue_lag": 0.0,
+            "max_write_time": 0.0
+        }
 
     async def connect(self):
         """Connect to Twitch IRC WebSocket"""
         try:
             self.websocket = await websockets.connect(self.irc_url)
             logging.info(
-                f"Connected to Twitch IRC for channel #{self.channel}")
+                f"Connected to Twitch IRC for {len(self.channels)} channel(s)")
 
             # Anonymous authentication
             await self.websocket.send(f"PASS SCHMOOPIIE\r\n")
@@ -69,82 +101,190 @@ class TwitchChatReader:
             # Request capabilities
             await self.websocket.send("CAP REQ :twitch.tv/commands twitch.tv/tags\r\n")
 
-            # Join the channel
-            await self.websocket.send(f"JOIN #{self.channel}\r\n")
+            # Join the channels in the background so reading starts right away
+            self.join_task = asyncio.create_task(self.join_channels())
 
             return True
         except Exception as e:
             logging.error(f"Error connecting to Twitch IRC: {e}")
             return False
 
+    async def join_channels(self):
+        """Join every channel, respecting the shared JOIN rate limit"""
+        try:
+            for channel in self.channels:
+                if self.join_limiter:
+                    await self.join_limiter.acquire()
+                await self.websocket.send(f"JOIN #{channel}\r\n")
+                logging.info(f"Joined #{channel}")
+        except websockets.exceptions.ConnectionClosed:
+            logging.warning("WebSocket connection closed while joining channels")
+
     async def read_messages(self):
-        """Read and process messages from the WebSocket"""
+        """Read and process messages from the WebSocket
+
+        Frames flow through three stages connected by bounded queues: the
+        receiver only reads from the socket, the parser turns frames into
+        stored messages and the writer appends batches to disk in a worker
+        thread, so a slow disk never delays reading or PONG replies.
+        """
         if not self.websocket:
             logging.error("WebSocket connection not established")
             return
 
         self.running = True
+        self.frame_queue = asyncio.Queue(maxsize=self.queue_size)
+        self.write_queue = asyncio.Queue(maxsize=Config.CHAT_WRITER_QUEUE_SIZE)
+        self.drained = asyncio.Event()
+
+        parser = asyncio.create_task(self.parse_frames())
+        writer = asyncio.create_task(self.write_batches())
         try:
-            while self.running:
-                message = await self.websocket.recv()
-                if "PING" in message:
-                    await self.websocket.send("PONG :tmi.twitch.tv\r\n")
-                    continue
+            await self.receive_frames()
+            if self.join_task:
+                self.join_task.cancel()
+
+            # Let the parser and writer finish everything already received
+            await self.frame_queue.put(None)
+            await parser
+            await self.write_queue.put(None)
+            await writer
+        finally:
+            parser.cancel()
+            writer.cancel()
+            self.running = False
+            self.drained.set()
+            logging.info(f"Chat reader pipeline stats: {self.stats}")
 
-                self.process_message(message)
+    async def receive_frames(self):
+        """Receive frames from the WebSocket and hand them to the parser"""
+        try:
+            while self.running:
+                frame = await self.websocket.recv()
+                self.stats["frames_received"] += 1
+
+                # Answer PINGs right away instead of waiting for the parser.
+                # A frame may carry several lines, so only a lone PING skips
+                # the queue
+                if "PING" in frame:
+                    lines = frame.splitlines()
+                    for line in lines:
+                        if line.startswith("PING"):
+                            await self.websocket.send(f"PONG :{parse_frame(line)[0].text or 'tmi.twitch.tv'}\r\n")
+                    if len(lines) == 1 and lines[0].startswith("PING"):
+                        continue
+
+                item = (frame, time.monotonic())
+                if self.overflow == "block":
+                    await self.frame_queue.put(item)
+                else:
+                    try:
+                        self.frame_queue.put_nowait(item)
+                    except asyncio.QueueFull:
+                        self.stats["frames_dropped"] += 1
+                        if self.stats["frames_dropped"] % 1000 == 1:
+                            logging.warning(
+                                f"Parser is falling behind, dropped {self.stats['frames_dropped']} frames so far")
         except websockets.exceptions.ConnectionClosed:
             logging.warning("WebSocket connection closed")
         except Exception as e:
             logging.error(f"Error reading messages: {e}")
-        finally:
-            self.running = False
+
+    async def parse_frames(self):
+        """Parse queued frames and queue full batches for writing"""
+        while True:
+            item = await self.frame_queue.get()
+            if item is None:
+                break
+
+            frame, received_at = item
+            lag = time.monotonic() - received_at
+            self.stats["queue_lag"] = lag
+            self.stats["max_queue_lag"] = max(self.stats["max_queue_lag"], lag)
+
+            # Twitch may pack several lines into a single frame
+            for message in parse_frame(frame):
+                if message.command == "PING":
+                    # Already answered by the receiver
+                    continue
+
+                sink = self.process_message(message)
+                if sink and (sink.spilled or sink.unsaved_count() >= self.batch_size):
+                    await self.queue_batch(sink)
+
+        # Queue whatever is left once the receiver has stopped
+        for sink in self.sinks.values():
+            await self.queue_batch(sink)
+
+    async def queue_batch(self, sink):
+        """Move a channel's unsaved messages to the writer queue"""
+        batch = sink.take_unsaved()
+        if batch:
+            # Waits when the writer is behind, slowing the parser instead of losing data
+            await self.write_queue.put((sink, batch))
+
+    async def write_batches(self):
+        """Append queued batches to the chat log in a worker thread"""
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.write_queue.get()
+            if item is None:
+                break
+
+            sink, batch = item
+            start = time.monotonic()
+            try:
+                await loop.run_in_executor(self.executor, sink.writer.write_records, batch)
+            except Exception as e:
+                logging.error(f"Error saving to {sink.writer.base_path}: {e}")
+                continue
+
+            elapsed = time.monotonic() - start
+            self.stats["messages_written"] += len(batch)
+            self.stats["max_write_time"] = max(self.stats["max_write_time"], elapsed)
+            logging.info(
+                f"Saved batch of {len(batch)} messages from #{sink.channel} in {elapsed:.3f}s. "
+                f"Total messages: {self.message_count}, queue lag: {self.stats['queue_lag']:.3f}s, "
+                f"dropped frames: {self.stats['frames_dropped']}")
 
     def process_message(self, message):
-        """Process and save a chat message"""
-        # Check if it's a PRIVMSG (chat message)
-        if "PRIVMSG" not in message:
-            return
+        """Process and save a parsed chat message, returning its channel sink"""
+        # Check if it's a PRIVMSG (chat message) for a channel we recorded
+        if message.command != "PRIVMSG":
+            return None
+
+        sink = self.sinks.get(message.channel)
+        if sink is None:
+            return None
 
         try:
-            # Extract username and message text using regex
-            username_match = re.search(r"display-name=([^;]+)", message)
-            message_match = re.search(r"PRIVMSG #\w+ :(.+)", message)
-
-            if username_match and message_match:
-                username = username_match.group(1)
-                msg_text = message_match.group(1)
-
-                # If username is empty, try to extract from a different pattern
-                if not username:
-                    alt_username_match = re.search(r":(\w+)!", message)
-                    if alt_username_match:
-                        username = alt_username_match.group(1)
-
-                # Save the message - keeping only the most recent message per user
-                if username and msg_text:
-                    # Strip trailing whitespace, carriage returns, and newlines
-                    msg_text = msg_text.rstrip('\r\n ')
-
-                    self.messages[username] = msg_text
-                    logging.debug(f"{username}: {msg_text}")
-
-                    # Increment message count
-                    self.message_count += 1
-
-                    # Save to JSON in batches
-                    if self.message_count % self.batch_size == 0:
-                        self.save_messages()
-                        logging.info(
-                            f"Saved batch of {self.message_count} messages. Total messages: {len(self.messages)}")
+            # Prefer the display name, falling back to the IRC nickname
+            username = message.tags.get("display-name") or message.nick
+
+            # Strip trailing whitespace, carriage returns, and newlines
+            msg_text = message.text.rstrip('\r\n ')
+
+            # Save every message along with its tags
+            if username and msg_text:
+                sink.messages.add(username, msg_text,
+                                  time.time(), message.tags)
+                logging.debug(f"#{sink.channel} {username}: {msg_text}")
+
+                # Increment message count
+                self.message_count += 1
         except Exception as e:
             logging.error(f"Error processing message: {e}")
+        return sink
 
     def save_messages(self):
-        """Save messages to a JSON file"""
-        try:
-            save_json(self.messages, self.output_file)
-        except Exception as e:
-            logging.error(f"Error saving to {self.output_file}: {e}")
+        """Append unsaved messages to each channel's current chat log segment"""
+        for sink in self.sinks.values():
+            try:
+                records = sink.take_unsaved()
+                if records:
+                    sink.writer.write_records(records)
+            except Exception as e:
+                logging.error(f"Error saving to {sink.writer.base_path}: {e}")
 
     async def start(self):
         """Start reading chat messages"""
@@ -159,8 +299,15 @@ class TwitchChatReader:
             await self.websocket.close()
             logging.info("WebSocket connection closed")
 
+        # Wait for the pipeline to drain before touching the writer
+        if self.drained:
+            await self.drained.wait()
+
         # Save messages before stopping
         self.save_messages()
+        for sink in self.sinks.values():
+            sink.writer.close()
+        self.executor.shutdown()
 
 
 async def main():
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from config.config import Config
+from twitch.chat_reader import TwitchChatReader
+
+
+class JoinRateLimiter:
+    """Sliding window limiter for IRC JOINs shared by every connection"""
+
+    def __init__(self, max_joins=None, window=None):
+        """Initialize the JOIN rate limiter"""
+        self.max_joins = max_joins or Config.TWITCH_JOIN_RATE_LIMIT
+        self.window = window or Config.TWITCH_JOIN_RATE_WINDOW
+        self.joins = deque()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until another JOIN may be sent"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                while self.joins and now - self.joins[0] >= self.window:
+                    self.joins.popleft()
+
+                if len(self.joins) < self.max_joins:
+                    self.joins.append(now)
+                    return
+
+                await asyncio.sleep(self.window - (now - self.joins[0]))
+
+
+class ChatReaderPool:
+    """Record many channels in one process over a small pool of connections
+
+    Channels are spread over connections of at most ``channels_per_connection``
+    channels each, and every connection shares one JOIN rate limiter.
+    """
+
+    def __init__(self, channels=None, channels_per_connection=None):
+        """Initialize the chat reader pool"""
+        self.channels = channels or Config.TWITCH_CHANNELS
+        self.channels_per_connection = channels_per_connection or Config.CHANNELS_PER_CONNECTION
+        self.join_limiter = JoinRateLimiter()
+
+        self.readers = [
+            TwitchChatReader(channels=self.channels[i:i + self.channels_per_connection],
+                             join_limiter=self.join_limiter)
+            for i in range(0, len(self.channels), self.channels_per_connection)
+        ]
+
+    @property
+    def stats(self):
+        """Pipeline stats summed (or maxed) over every connection"""
+        totals = {}
+        for reader in self.readers:
+            for key, value in reader.stats.items():
+                if key.startswith("max_") or key == "queue_lag":
+                    totals[key] = max(totals.get(key, 0), value)
+                else:
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    async def start(self):
+        """Start reading chat on every connection"""
+        logging.info(
+            f"Recording {len(self.channels)} channel(s) over {len(self.readers)} connection(s)")
+        await asyncio.gather(*(reader.start() for reader in self.readers))
+
+    async def stop(self):
+        """Stop every connection and flush their chat logs"""
+        await asyncio.gather(*(reader.stop() for reader in self.readers))
+        logging.info(f"Chat reader pool stats: {self.stats}")
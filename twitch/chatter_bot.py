@@ -1,10 +1,21 @@
+import copy
 import logging
+import os
+import sys
+import threading
+import time
 from twitchio.ext import commands
 from config.config import Config
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import (AutoModelForCausalLM, AutoTokenizer, DynamicCache, StoppingCriteriaList,
+                          StopStringCriteria)
 import torch
 import asyncio
 from peft import PeftModel
+from fine_tuning.model_exporter import merged_model_is_current
+from twitch.candidate_buffer import CandidateBuffer
+from twitch.chat_context import ChatContext
+from twitch.inference_server import InferenceClient
+from twitch.inference_worker import InferenceWorker
 
 logging.basicConfig(
     level=logging.INFO,
@@ -12,6 +23,359 @@ logging.basicConfig(
 )
 
 
+def quantize_for_cpu(model):
+    """Quantize the linear layers to int8 weights with per-channel scales
+
+    Activations are quantized on the fly, so no calibration data is needed.
+    The model is quantized in place to avoid holding a float copy.
+    """
+    qconfig = torch.ao.quantization.per_channel_dynamic_qconfig
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear: qconfig}, dtype=torch.qint8, inplace=True)
+
+
+class ChatMessageGenerator:
+    """Generate chat messages with the fine-tuned model"""
+
+    # Use a simple system message to simulate a user trigger, in the same
+    # format as during training
+    PROMPT = "<|im_start|>user\nSay something interesting to chat<|im_end|>\n<|im_start|>assistant\n"
+
+    # A chat message ends at the end of its line or the assistant's turn
+    STOP_STRINGS = ["\n", "<|im_end|>"]
+
+    def __init__(self, use_merged=None, quantization=None, draft_model=None):
+        """Load the merged model, or the base model and the fine-tuned adapter
+
+        By default the merged model is used when it is up to date with the
+        adapter, and quantized on CPU according to CPU_QUANTIZATION.
+        DRAFT_MODEL, or draft_model, adds a small model for assisted
+        generation.
+        """
+        use_cuda = torch.cuda.is_available() and not Config.USE_CPU
+        if Config.USE_CPU and Config.CPU_THREADS:
+            torch.set_num_threads(Config.CPU_THREADS)
+        torch_dtype = torch.float16 if use_cuda else torch.float32
+
+        merged_is_current = merged_model_is_current()
+        if use_merged is None:
+            use_merged = merged_is_current
+
+        if use_merged:
+            # A single memory-mapped load with the adapter already merged in
+            logging.info(f"Loading merged model from: {Config.MERGED_MODEL_PATH}")
+            self.tokenizer = AutoTokenizer.from_pretrained(Config.MERGED_MODEL_PATH)
+            self.model = AutoModelForCausalLM.from_pretrained(Config.MERGED_MODEL_PATH, torch_dtype=torch_dtype)
+        else:
+            if os.path.exists(Config.MERGED_MODEL_PATH) and not merged_is_current:
+                logging.warning(f"{Config.MERGED_MODEL_PATH} is older than the adapter, "
+                                f"run `python main.py export` to update it")
+
+            # Load the base model and tokenizer
+            logging.info(f"Loading base model: {Config.BASE_MODEL}")
+            self.tokenizer = AutoTokenizer.from_pretrained(Config.MODEL_PATH)
+            self.model = AutoModelForCausalLM.from_pretrained(Config.BASE_MODEL, torch_dtype=torch_dtype)
+
+            # Then load the adapter on top of the base model
+            logging.info(f"Loading adapter from: {Config.MODEL_PATH}")
+            self.model = PeftModel.from_pretrained(self.model, Config.MODEL_PATH)
+        self.model.to("cuda" if use_cuda else "cpu")
+
+        # Set model to evaluation mode
+        self.model.eval()
+
+        # The prompt's token ids and KV cache, reused across generations
+        self.prompt_text = None
+        self.prompt_ids = None
+        self.prompt_cache_key = []
+        self.prompt_cache_model = None
+        self.cached_prompt = None
+
+        self.stop_criteria = None
+        self.stats = {
+            "calls": 0,
+            "messages": 0,
+            "tokens": 0,  # Tokens generated before each message stopped
+            "latency": 0.0,  # Total seconds spent in generate
+            "deadline_hits": 0,  # Calls cut short by GENERATION_MAX_TIME
+            "length_hits": 0,  # Messages cut short by MAX_NEW_TOKENS
+        }
+
+        quantization = quantization or Config.CPU_QUANTIZATION
+        if quantization == 'int8':
+            if use_cuda or not use_merged:
+                logging.warning("int8 quantization needs the merged model on CPU, running unquantized")
+            else:
+                logging.info("Quantizing the model to int8")
+                self.model = quantize_for_cpu(self.model)
+        elif quantization != 'none':
+            logging.warning(f"Unknown CPU_QUANTIZATION {quantization}, running unquantized")
+
+        # A small draft model proposes tokens that the fine-tuned model verifies
+        self.draft_model = None
+        self.draft_tokenizer = None
+        draft_model = draft_model or Config.DRAFT_MODEL
+        if draft_model:
+            logging.info(f"Loading draft model: {draft_model}")
+            self.draft_model = AutoModelForCausalLM.from_pretrained(draft_model, torch_dtype=torch_dtype)
+            self.draft_model.to("cuda" if use_cuda else "cpu")
+            self.draft_model.eval()
+            self.draft_model.generation_config.num_assistant_tokens = Config.DRAFT_LOOKAHEAD
+            self.draft_model.generation_config.num_assistant_tokens_schedule = Config.DRAFT_LOOKAHEAD_SCHEDULE
+            self.draft_model.generation_config.assistant_confidence_threshold = Config.DRAFT_CONFIDENCE
+            if quantization == 'int8' and not use_cuda:
+                self.draft_model = quantize_for_cpu(self.draft_model)
+
+            # A draft with a different vocabulary needs both tokenizers to translate its tokens
+            draft_tokenizer = AutoTokenizer.from_pretrained(draft_model)
+            if draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+                self.draft_tokenizer = draft_tokenizer
+
+    def prompt_inputs(self):
+        """Tokenize the prompt, once per prompt text"""
+        if self.prompt_text != self.PROMPT:
+            self.prompt_ids = self.tokenizer(
+                self.PROMPT, return_tensors="pt", return_token_type_ids=False)["input_ids"].to(self.model.device)
+            self.prompt_text = self.PROMPT
+        return self.prompt_ids
+
+    def prompt_error(self, prompt_ids):
+        """Why the model cannot generate from prompt token ids, or None if it can"""
+        if not prompt_ids:
+            return "prompt_ids is empty"
+        vocab_size = self.model.config.vocab_size
+        if min(prompt_ids) < 0 or max(prompt_ids) >= vocab_size:
+            return f"prompt_ids must be token ids between 0 and {vocab_size - 1}"
+        max_length = self.model.config.max_position_embeddings - Config.MAX_NEW_TOKENS
+        if len(prompt_ids) > max_length:
+            return f"prompt_ids is longer than the {max_length} tokens the model has room for"
+        return None
+
+    def prompt_cache(self, input_ids, batch_size=1):
+        """Return a copy of the prompt's KV cache, computing what is missing
+
+        The cache covers all but the last prompt token, which generate needs
+        to run itself to produce the first token's logits. When the prompt
+        changes, the cache is cut back to the tokens it shares with the new
+        prompt and only the rest is computed, so a chat window that grew by
+        a message costs just that message. A changed model starts over.
+        """
+        target = input_ids[0, :-1].tolist()
+        if self.prompt_cache_model is not self.model:
+            self.prompt_cache_key = []
+
+        common = 0
+        for cached, token in zip(self.prompt_cache_key, target):
+            if cached != token:
+                break
+            common += 1
+
+        if self.cached_prompt is None or common == 0:
+            self.cached_prompt = DynamicCache()
+        elif common < len(self.prompt_cache_key):
+            self.cached_prompt.crop(common)
+        if common < len(target):
+            with torch.no_grad():
+                self.cached_prompt = self.model(input_ids[:, common:-1], past_key_values=self.cached_prompt,
+                                                use_cache=True).past_key_values
+        self.prompt_cache_key = target
+        self.prompt_cache_model = self.model
+
+        # generate extends the cache in place, so every run gets its own copy
+        cache = copy.deepcopy(self.cached_prompt)
+        if batch_size > 1:
+            cache.batch_repeat_interleave(batch_size)
+        return cache
+
+    def padded_prompt_cache(self, input_ids, attention_mask, rows):
+        """KV cache of left padded prompts, repeated for each of their rows
+
+        Like prompt_cache it covers all but the last prompt token, but it is
+        computed for this batch only and not kept.
+        """
+        position_ids = (attention_mask.cumsum(dim=1) - 1).clamp(min=0)
+        with torch.no_grad():
+            cache = self.model(input_ids[:, :-1], attention_mask=attention_mask[:, :-1],
+                               position_ids=position_ids[:, :-1], past_key_values=DynamicCache(),
+                               use_cache=True).past_key_values
+        cache.reorder_cache(rows)
+        return cache
+
+    def stopping_criteria(self):
+        """Stop each message at the end of its line or turn, built once per tokenizer"""
+        if self.stop_criteria is None:
+            self.stop_criteria = StopStringCriteria(self.tokenizer, self.STOP_STRINGS)
+        return StoppingCriteriaList([self.stop_criteria])
+
+    def generate_candidates(self, count, max_new_tokens=None, prompt_ids=None):
+        """Sample several chat messages in one batched generate call
+
+        Each message stops at a newline, <|im_end|> or the end of sequence
+        token, and the whole call stops after GENERATION_MAX_TIME seconds.
+        prompt_ids replaces the fixed prompt, for example with one that
+        includes recent chat.
+        """
+        max_new_tokens = max_new_tokens or Config.MAX_NEW_TOKENS
+        if self.draft_model is not None and count > 1:
+            # Assisted generation runs one sequence at a time
+            return [message for _ in range(count)
+                    for message in self.generate_candidates(1, max_new_tokens, prompt_ids)]
+
+        if prompt_ids is None:
+            input_ids = self.prompt_inputs()
+        else:
+            input_ids = torch.tensor([prompt_ids], dtype=torch.long, device=self.model.device)
+        input_ids = input_ids.expand(count, -1)
+        kwargs = {}
+        if Config.PROMPT_CACHE and input_ids.shape[1] > 1:
+            kwargs["past_key_values"] = self.prompt_cache(input_ids[:1], batch_size=count)
+        if self.draft_model is not None:
+            kwargs["assistant_model"] = self.draft_model
+            if self.draft_tokenizer is not None:
+                kwargs.update(tokenizer=self.tokenizer, assistant_tokenizer=self.draft_tokenizer)
+        return self._generate(input_ids, torch.ones_like(input_ids), max_new_tokens, **kwargs)
+
+    def generate_batch(self, requests, max_new_tokens=None):
+        """Sample messages for several prompts in one batched generate call
+
+        requests is a list of (prompt_ids, count) pairs, with None for the
+        fixed prompt, and a list of count messages is returned for each.
+        When every request has the same prompt they share its KV cache.
+        Different prompts are left padded to the same length, and each is
+        run through the model once for all of its messages.
+        """
+        max_new_tokens = max_new_tokens or Config.MAX_NEW_TOKENS
+        prompts = [self.prompt_inputs()[0].tolist() if prompt_ids is None else list(prompt_ids)
+                   for prompt_ids, _ in requests]
+        counts = [count for _, count in requests]
+        if all(prompt == prompts[0] for prompt in prompts):
+            messages = self.generate_candidates(sum(counts), max_new_tokens, prompts[0])
+        elif self.draft_model is not None:
+            messages = [message for prompt, count in zip(prompts, counts)
+                        for message in self.generate_candidates(count, max_new_tokens, prompt)]
+        else:
+            width = max(len(prompt) for prompt in prompts)
+            input_ids = torch.full((len(prompts), width), self.tokenizer.eos_token_id, dtype=torch.long)
+            attention_mask = torch.zeros_like(input_ids)
+            for row, prompt in enumerate(prompts):
+                input_ids[row, width - len(prompt):] = torch.tensor(prompt, dtype=torch.long)
+                attention_mask[row, width - len(prompt):] = 1
+            input_ids = input_ids.to(self.model.device)
+            attention_mask = attention_mask.to(self.model.device)
+            rows = torch.arange(len(prompts), device=self.model.device).repeat_interleave(
+                torch.tensor(counts, device=self.model.device))
+            kwargs = {}
+            if Config.PROMPT_CACHE:
+                kwargs["past_key_values"] = self.padded_prompt_cache(input_ids, attention_mask, rows)
+            messages = self._generate(input_ids[rows], attention_mask[rows], max_new_tokens, **kwargs)
+
+        # Split the messages back up by request
+        results = []
+        for count in counts:
+            results.append(messages[:count])
+            messages = messages[count:]
+        return results
+
+    def _generate(self, input_ids, attention_mask, max_new_tokens, **kwargs):
+        """Run generate and decode each sequence's message"""
+        start = time.perf_counter()
+        with torch.no_grad():
+            outputs = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=max_new_tokens,
+                max_time=Config.GENERATION_MAX_TIME,
+                stopping_criteria=self.stopping_criteria(),
+                temperature=0.7,
+                top_p=0.9,
+                do_sample=True,
+                pad_token_id=self.tokenizer.eos_token_id,
+                **kwargs
+            )
+        latency = time.perf_counter() - start
+
+        # Decode only the new tokens. Finished messages are padded with the
+        # end of sequence token, so the first one marks where each ended
+        new_tokens = outputs[:, input_ids.shape[1]:]
+        finished = new_tokens == self.tokenizer.eos_token_id
+        lengths = torch.where(finished.any(dim=1), finished.int().argmax(dim=1),
+                              new_tokens.shape[1]).tolist()
+        messages = []
+        for tokens, length in zip(new_tokens, lengths):
+            text = self.tokenizer.decode(tokens[:length], skip_special_tokens=True)
+            messages.append(text.split("<|im_end|>")[0].strip().split("\n")[0].strip())
+
+        self.record_stats(lengths, new_tokens.shape[1], max_new_tokens, latency)
+        return messages
+
+    def record_stats(self, lengths, steps, max_new_tokens, latency):
+        """Record the token counts and latency of a generate call"""
+        deadline_hit = steps < max_new_tokens and max(lengths) == steps and latency >= Config.GENERATION_MAX_TIME
+        self.stats["calls"] += 1
+        self.stats["messages"] += len(lengths)
+        self.stats["tokens"] += sum(lengths)
+        self.stats["latency"] += latency
+        self.stats["deadline_hits"] += deadline_hit
+        self.stats["length_hits"] += sum(length == max_new_tokens for length in lengths)
+        logging.info(f"Generated {len(lengths)} message(s) in {latency:.2f}s "
+                     f"({steps} steps, {steps / latency:.1f} steps/s), tokens per message: {lengths}"
+                     + (", stopped at the deadline" if deadline_hit else ""))
+
+    def generate(self, max_new_tokens=None, prompt_ids=None):
+        """Generate a single chat message"""
+        return self.generate_candidates(1, max_new_tokens=max_new_tokens, prompt_ids=prompt_ids)[0]
+
+
+class ApprovalConsole:
+    """Ask on the console whether to send each generated message
+
+    stdin is read on a daemon thread, so waiting for an answer never blocks
+    the bot. Messages wait in a bounded queue; generation pauses while it
+    is full.
+    """
+
+    def __init__(self, maxsize=None):
+        """Initialize the approval console"""
+        self.pending = asyncio.Queue(maxsize=maxsize or Config.APPROVAL_QUEUE_SIZE)
+        self.answers = asyncio.Queue()
+        self.reader = None
+
+    def _read_answers(self, loop):
+        for line in sys.stdin:
+            loop.call_soon_threadsafe(self.answers.put_nowait, line.strip())
+        loop.call_soon_threadsafe(self.answers.put_nowait, None)
+
+    async def submit(self, message):
+        """Queue a message for approval, waiting while the queue is full"""
+        await self.pending.put(message)
+
+    async def run(self, send, on_reject=None):
+        """Ask about each queued message in turn and send the approved ones"""
+        if self.reader is None:
+            self.reader = threading.Thread(target=self._read_answers, args=(asyncio.get_running_loop(),),
+                                           daemon=True)
+            self.reader.start()
+
+        while True:
+            message = await self.pending.get()
+            print(f"Generated message: {message}\n"
+                  f"Do you want to send this message? (y/n, {self.pending.qsize()} more waiting): ",
+                  end="", flush=True)
+            response = await self.answers.get()
+            if response is None:
+                logging.error("Console closed, no more messages can be approved")
+                return
+
+            if response.lower() == "y":
+                try:
+                    await send(message)
+                except Exception as e:
+                    logging.error(f"Error sending message: {e}")
+            else:
+                logging.info("User chose not to send the message.")
+                if on_reject:
+                    asyncio.get_running_loop().create_task(on_reject(message))
+
+
 class TwitchBot(commands.Bot):
     def __init__(self):
         super().__init__(
@@ -20,73 +384,71 @@ class TwitchBot(commands.Bot):
             prefix='!',
             initial_channels=[Config.TWITCH_CHANNEL]
         )
-        
-        # Load the base model and tokenizer
-        logging.info(f"Loading base model: {Config.BASE_MODEL}")
-        self.tokenizer = AutoTokenizer.from_pretrained(Config.MODEL_PATH)
-        
-        # Load the base model first
-        self.model = AutoModelForCausalLM.from_pretrained(
-            Config.BASE_MODEL,
-            torch_dtype=torch.float16 if torch.cuda.is_available() else torch.float32
-        )
-        
-        # Then load the adapter on top of the base model
-        logging.info(f"Loading adapter from: {Config.MODEL_PATH}")
-        self.model = PeftModel.from_pretrained(self.model, Config.MODEL_PATH)
-        self.model.to("cuda" if torch.cuda.is_available() else "cpu")
-        
-        # Set model to evaluation mode
-        self.model.eval()
+
+        # The model is loaded and run on a worker thread so the bot stays
+        # responsive, and messages wait for approval without blocking it.
+        # Candidates are generated ahead of time while the bot is idle. With
+        # INFERENCE_SERVER_URL set, a shared inference server runs the model
+        if Config.INFERENCE_SERVER_URL:
+            self.worker = InferenceClient()
+        else:
+            self.worker = InferenceWorker(ChatMessageGenerator)
+        self.approvals = ApprovalConsole()
+
+        # Optionally prompt with a window of recent chat, tokenized as it arrives
+        self.context = None
+        if Config.CHAT_CONTEXT:
+            self.context = ChatContext(AutoTokenizer.from_pretrained(Config.MODEL_PATH))
+            self.candidates = CandidateBuffer(self.worker, prompt=self.chat_prompt,
+                                              max_age=Config.CHAT_CONTEXT_CANDIDATE_AGE)
+        else:
+            self.candidates = CandidateBuffer(self.worker)
 
         # Message generation frequency in seconds
         self.message_frequency = Config.MESSAGE_FREQUENCY
+        self.tasks = []  # Background tasks, started on the first event_ready
 
     async def event_ready(self):
         logging.info(f'Bot is ready | {self.nick}')
-        
-        # Start the message generation task
-        self.loop.create_task(self.generate_and_send_messages())
+
+        # event_ready fires again after every reconnect, the tasks keep running
+        if self.tasks:
+            return
+
+        # Start the candidate generation, message and approval tasks
+        self.tasks = [
+            self.loop.create_task(self.candidates.run()),
+            self.loop.create_task(self.generate_and_send_messages()),
+            self.loop.create_task(self.approvals.run(self.send_message, on_reject=self.offer_next_message)),
+        ]
+
+    async def event_message(self, message):
+        if self.context is not None and not message.echo:
+            self.context.add(message.author.name, message.content)
+        await self.handle_commands(message)
+
+    def chat_prompt(self):
+        """Prompt token ids with the recent chat, or None for the fixed prompt while chat is quiet"""
+        ids = self.context.prompt_ids()
+        return ids if len(self.context) else None
+
+    async def send_message(self, message):
+        """Send a message to the channel"""
+        await self.get_channel(Config.TWITCH_CHANNEL).send(message)
+
+    async def offer_next_message(self, rejected):
+        """Offer the next ready candidate straight away after a rejection"""
+        await self.approvals.submit(await self.candidates.take())
 
     async def generate_and_send_messages(self):
         while True:
             try:
-                # Generate a random message using the same format as during training
-                # Use a simple system message to simulate a user trigger
-                input_text = "<|im_start|>user\nSay something interesting to chat<|im_end|>\n<|im_start|>assistant\n"
-                
-                inputs = self.tokenizer(input_text, return_tensors="pt").to(self.model.device)
-                
-                with torch.no_grad():
-                    outputs = self.model.generate(
-                        **inputs, 
-                        max_new_tokens=80,
-                        temperature=0.7,
-                        top_p=0.9,
-                        do_sample=True,
-                        pad_token_id=self.tokenizer.eos_token_id
-                    )
-                
-                message = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-                
-                # Extract just the assistant's reply
-                parts = message.split("<|im_start|>assistant\n")
-                if len(parts) > 1:
-                    message = parts[1].strip()
-                else:
-                    # Fallback in case the format is different
-                    message = message.replace(input_text, "").strip()
-
-                # Ask the user if they want to send the message
+                message = await self.candidates.take()
                 logging.info("Generated message: " + message)
-                response = input("Do you want to send this message? (y/n): ")
-
-                if response.lower() == "y":
-                    # Send the generated message to the channel
-                    await self.get_channel(Config.TWITCH_CHANNEL).send(message)
-                else:
-                    logging.info("User chose not to send the message.")
-                
+
+                # Queue the message for approval, waiting if too many are pending
+                await self.approvals.submit(message)
+
                 # Wait for the specified frequency before generating the next message
                 await asyncio.sleep(self.message_frequency)
             except Exception as e:
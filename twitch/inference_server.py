@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+from aiohttp import web
+
+from config.config import Config
+from twitch.inference_worker import InferenceWorker
+
+
+class InferenceServer:
+    """Serve chat message generation to several bots from one model
+
+    The model is loaded once, on an inference worker. Bots post generation
+    requests over local HTTP, and requests that arrive while the model is
+    busy, or within ``batch_wait`` seconds of each other, are generated
+    together in one batched call of up to ``max_batch`` messages. At most
+    ``queue_size`` requests wait for the model; more are turned away with
+    503 so a slow model does not build an ever growing backlog. A request
+    that is not answered within its timeout gets 504 and is dropped from
+    the queue if it has not started yet.
+    """
+
+    def __init__(self, generator_factory, host=None, port=None, queue_size=None, max_batch=None,
+                 batch_wait=None, timeout=None):
+        """Initialize the inference server"""
+        self.worker = InferenceWorker(generator_factory)
+        self.host = host or Config.INFERENCE_SERVER_HOST
+        self.port = port or Config.INFERENCE_SERVER_PORT
+        self.max_batch = max_batch or Config.INFERENCE_SERVER_MAX_BATCH
+        self.batch_wait = Config.INFERENCE_SERVER_BATCH_WAIT if batch_wait is None else batch_wait
+        self.timeout = timeout or Config.INFERENCE_SERVER_TIMEOUT
+        self.queue = asyncio.Queue(maxsize=queue_size or Config.INFERENCE_SERVER_QUEUE_SIZE)
+        self.held = None  # Request that did not fit in the last batch, first in the next one
+        self.batcher = None
+        self.stats = {
+            "requests": 0,
+            "rejected": 0,  # Turned away because the queue was full
+            "timeouts": 0,
+            "errors": 0,
+            "batches": 0,
+            "batched_requests": 0,
+            "batched_messages": 0,
+        }
+
+    def app(self):
+        """The aiohttp application with the server's routes"""
+        app = web.Application()
+        app.add_routes([web.post("/generate", self.handle_generate), web.get("/stats", self.handle_stats)])
+        app.on_startup.append(self._start)
+        app.on_cleanup.append(self._cleanup)
+        return app
+
+    async def _start(self, app):
+        await self.worker.start()
+        self.batcher = asyncio.get_running_loop().create_task(self.batch_requests())
+
+    async def _cleanup(self, app):
+        if self.batcher is not None:
+            self.batcher.cancel()
+            try:
+                await self.batcher
+            except asyncio.CancelledError:
+                pass
+            self.batcher = None
+        self.worker.close()
+
+    async def handle_generate(self, request):
+        """Queue a request for count messages and answer with them once generated"""
+        try:
+            body = await request.json()
+            count = int(body.get("count", 1))
+            prompt_ids = body.get("prompt_ids")
+            if prompt_ids is not None:
+                prompt_ids = [int(token) for token in prompt_ids]
+            timeout = min(float(body.get("timeout", self.timeout)), self.timeout)
+        except (ValueError, TypeError, AttributeError) as e:
+            return web.json_response({"error": f"Invalid request: {e}"}, status=400)
+        if not 1 <= count <= self.max_batch:
+            return web.json_response({"error": f"count must be between 1 and {self.max_batch}"}, status=400)
+
+        # Reject bad prompts here, since a failing batch fails every request in it
+        error = self.worker.generator.prompt_error(prompt_ids) if prompt_ids is not None else None
+        if error:
+            return web.json_response({"error": error}, status=400)
+
+        self.stats["requests"] += 1
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((prompt_ids, count, future))
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            return web.json_response({"error": "Inference queue is full"}, status=503)
+
+        try:
+            messages = await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            # A request that has not started yet is skipped by the batcher
+            future.cancel()
+            self.stats["timeouts"] += 1
+            return web.json_response({"error": f"Timed out after {timeout:.1f}s"}, status=504)
+        except Exception as e:
+            return web.json_response({"error": f"Generation failed: {e}"}, status=500)
+        return web.json_response({"messages": messages})
+
+    async def handle_stats(self, request):
+        """Server, worker and generator statistics"""
+        generator = self.worker.generator
+        return web.json_response({
+            "server": self.stats,
+            "queued": self.queue.qsize(),
+            "worker": self.worker.stats,
+            "generator": generator.stats if generator is not None else None,
+        })
+
+    async def _next_batch(self):
+        """Collect waiting requests into a batch of at most max_batch messages"""
+        batch = []
+        size = 0
+        deadline = None
+        while size < self.max_batch:
+            if self.held is not None:
+                item, self.held = self.held, None
+            elif not batch:
+                item = await self.queue.get()
+                deadline = time.monotonic() + self.batch_wait
+            else:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+
+            _, count, future = item
+            if future.done():
+                continue
+            if size + count > self.max_batch:
+                self.held = item
+                break
+            if not batch and deadline is None:
+                deadline = time.monotonic() + self.batch_wait
+            batch.append(item)
+            size += count
+        return batch
+
+    async def batch_requests(self):
+        """Generate queued requests in batches, one batch at a time"""
+        while True:
+            batch = await self._next_batch()
+            if not batch:
+                continue
+
+            requests = [(prompt_ids, count) for prompt_ids, count, _ in batch]
+            try:
+                results = await self.worker.run("generate_batch", requests)
+            except Exception as e:
+                logging.error(f"Error generating a batch of {len(batch)} requests: {e}")
+                self.stats["errors"] += 1
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.stats["batches"] += 1
+            self.stats["batched_requests"] += len(batch)
+            self.stats["batched_messages"] += sum(count for _, count in requests)
+            for (_, _, future), messages in zip(batch, results):
+                if not future.done():
+                    future.set_result(messages)
+
+    def run(self):
+        """Serve until interrupted"""
+        logging.info(f"Inference server listening on http://{self.host}:{self.port}")
+        web.run_app(self.app(), host=self.host, port=self.port, print=None)
+
+
+class InferenceClient:
+    """Generate chat messages on a shared inference server
+
+    A drop-in replacement for InferenceWorker in the bot, so several bots
+    can share one copy of the model.
+    """
+
+    def __init__(self, url=None, timeout=None):
+        """Initialize the inference client"""
+        self.url = (url or Config.INFERENCE_SERVER_URL).rstrip("/")
+        self.timeout = timeout or Config.INFERENCE_SERVER_TIMEOUT
+        self.session = None
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "generation_time": 0.0,  # Total seconds spent waiting for the server
+            "max_generation_time": 0.0,
+        }
+
+    async def start(self):
+        """Open the HTTP session, once"""
+        if self.session is None:
+            # Leave the server time to answer with its own timeout first
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout + 5))
+
+    async def generate_candidates(self, count, prompt_ids=None):
+        """Sample several chat messages on the server"""
+        await self.start()
+        start = time.perf_counter()
+        try:
+            async with self.session.post(f"{self.url}/generate", json={
+                "count": count, "prompt_ids": prompt_ids, "timeout": self.timeout,
+            }) as response:
+                body = await response.json()
+                if response.status != 200:
+                    raise RuntimeError(f"Inference server returned {response.status}: {body.get('error')}")
+                messages = body["messages"]
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+
+        generation_time = time.perf_counter() - start
+        self.stats["requests"] += 1
+        self.stats["generation_time"] += generation_time
+        self.stats["max_generation_time"] = max(self.stats["max_generation_time"], generation_time)
+        logging.info(f"Inference server answered in {generation_time:.2f}s")
+        return messages
+
+    async def generate(self):
+        """Generate a chat message on the server"""
+        return (await self.generate_candidates(1))[0]
+
+    async def close(self):
+        """Close the HTTP session"""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class InferenceWorker:
+    """Run a chat message generator on its own thread
+
+    The model is loaded and every message generated on a single worker
+    thread, so the event loop keeps handling Twitch while the model runs.
+    Requests are served in the order they are made.
+    """
+
+    def __init__(self, generator_factory):
+        """Initialize the inference worker"""
+        self.generator_factory = generator_factory
+        self.generator = None
+        self.loading = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self.stats = {
+            "requests": 0,
+            "errors": 0,
+            "load_time": 0.0,
+            "generation_time": 0.0,  # Total seconds spent generating
+            "max_generation_time": 0.0,
+            "queue_wait": 0.0,  # Total seconds requests waited for the worker
+        }
+
+    async def start(self):
+        """Load the generator on the worker thread, once"""
+        if self.loading is None:
+            self.loading = asyncio.ensure_future(self._load())
+        await asyncio.shield(self.loading)
+
+    async def _load(self):
+        start = time.perf_counter()
+        self.generator = await asyncio.get_running_loop().run_in_executor(self.executor, self.generator_factory)
+        self.stats["load_time"] = time.perf_counter() - start
+        logging.info(f"Inference worker ready in {self.stats['load_time']:.2f}s")
+
+    async def run(self, method, *args, **kwargs):
+        """Call a generator method on the worker thread and wait for its result"""
+        await self.start()
+        submitted = time.perf_counter()
+        started = None
+
+        def call():
+            nonlocal started
+            started = time.perf_counter()
+            return getattr(self.generator, method)(*args, **kwargs)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+        except Exception:
+            self.stats["errors"] += 1
+            raise
+        finally:
+            if started is not None:
+                generation_time = time.perf_counter() - started
+                self.stats["requests"] += 1
+                self.stats["queue_wait"] += started - submitted
+                self.stats["generation_time"] += generation_time
+                self.stats["max_generation_time"] = max(self.stats["max_generation_time"], generation_time)
+                logging.info(f"Inference took {generation_time:.2f}s (waited {started - submitted:.2f}s)")
+
+    async def generate(self):
+        """Generate a chat message without blocking the event loop"""
+        return await self.run("generate")
+
+    async def generate_candidates(self, count, prompt_ids=None):
+        """Sample several chat messages without blocking the event loop"""
+        return await self.run("generate_candidates", count, prompt_ids=prompt_ids)
+
+    def close(self):
+        """Stop the worker thread once the running request is done"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
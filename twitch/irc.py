@@ -0,0 +1,141 @@
+"""Single-pass parser for Twitch IRC (IRCv3) lines"""
+
+# Escape sequences used in IRCv3 tag values
+TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+class IRCMessage:
+    """A parsed IRC line: tags, prefix, command and params
+
+    Tags are kept as the raw tag string and only decoded into a dictionary
+    when ``tags`` is first accessed, since most consumers only need one or
+    two of them (see ``tag``).
+    """
+
+    __slots__ = ("raw_tags", "prefix", "command", "params", "_tags")
+
+    def __init__(self, raw_tags, prefix, command, params):
+        self.raw_tags = raw_tags
+        self.prefix = prefix
+        self.command = command
+        self.params = params
+        self._tags = None
+
+    def __repr__(self):
+        return f"IRCMessage({self.command!r}, prefix={self.prefix!r}, params={self.params!r})"
+
+    @property
+    def tags(self):
+        """The decoded IRCv3 tags"""
+        if self._tags is None:
+            self._tags = parse_tags(self.raw_tags) if self.raw_tags else {}
+        return self._tags
+
+    def tag(self, key, default=None):
+        """Look up a single tag without decoding all of them"""
+        if self._tags is not None:
+            return self._tags.get(key, default)
+
+        raw_tags = self.raw_tags
+        if raw_tags.startswith(key + "="):
+            start = len(key) + 1
+        else:
+            # Match ';' before the key so only whole keys match
+            needle = ";" + key + "="
+            start = raw_tags.find(needle)
+            if start == -1:
+                return default
+            start += len(needle)
+
+        end = raw_tags.find(";", start)
+        value = raw_tags[start:] if end == -1 else raw_tags[start:end]
+        return unescape_tag_value(value)
+
+    @property
+    def nick(self):
+        """The nickname from the prefix, e.g. ``nick`` in ``nick!user@host``"""
+        if not self.prefix:
+            return None
+        return self.prefix.split("!", 1)[0]
+
+    @property
+    def channel(self):
+        """The channel the message was sent to, without the leading '#'"""
+        if self.params and self.params[0].startswith("#"):
+            return self.params[0][1:]
+        return None
+
+    @property
+    def text(self):
+        """The trailing parameter, i.e. the chat message text"""
+        return self.params[-1] if self.params else ""
+
+
+def unescape_tag_value(value):
+    """Unescape an IRCv3 tag value"""
+    if "\\" not in value:
+        return value
+
+    result = []
+    i = 0
+    while i < len(value):
+        char = value[i]
+        if char == "\\":
+            i += 1
+            if i < len(value):
+                result.append(TAG_ESCAPES.get(value[i], value[i]))
+        else:
+            result.append(char)
+        i += 1
+    return "".join(result)
+
+
+def parse_tags(raw_tags):
+    """Parse the tag section of a line (without the leading '@')"""
+    try:
+        tags = dict(tag.split("=", 1) for tag in raw_tags.split(";"))
+    except ValueError:
+        # Tags without a value are allowed but rare
+        tags = dict(tag.partition("=")[::2] for tag in raw_tags.split(";"))
+
+    if "\\" in raw_tags:
+        for key, value in tags.items():
+            tags[key] = unescape_tag_value(value)
+    return tags
+
+
+def parse_line(line):
+    """Parse a single IRC line into an IRCMessage, or None if it is empty"""
+    raw_tags = ""
+    if line.startswith("@"):
+        raw_tags, _, line = line[1:].partition(" ")
+        line = line.lstrip(" ")
+
+    prefix = None
+    if line.startswith(":"):
+        prefix, _, line = line[1:].partition(" ")
+
+    # Command and middle params, then everything after " :" as the trailing param
+    head, separator, trailing = line.partition(" :")
+    params = head.split()
+    if not params:
+        return None
+
+    command = params.pop(0)
+    if separator:
+        params.append(trailing)
+
+    return IRCMessage(raw_tags, prefix, command, params)
+
+
+def parse_frame(frame):
+    """Split a websocket frame into lines and parse each one"""
+    messages = []
+    for line in frame.split("\n"):
+        line = line.rstrip("\r")
+        if not line:
+            continue
+        message = parse_line(line)
+        if message is not None:
+            messages.append(message)
+    return messages
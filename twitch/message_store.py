@@ -0,0 +1,145 @@
+import logging
+
+from config.config import Config
+
+
+class ChatMessage:
+    """A single chat message with its timestamp and IRC tags
+
+    Tag keys are stored as a shared, interned tuple and the values as a
+    parallel tuple, so messages carrying the same set of tags do not each
+    pay for their own dictionary.
+    """
+
+    __slots__ = ("username", "text", "timestamp", "tag_keys", "tag_values", "emotes")
+
+    def __init__(self, username, text, timestamp, tag_keys=(), tag_values=(), emotes=()):
+        self.username = username
+        self.text = text
+        self.timestamp = timestamp
+        self.tag_keys = tag_keys
+        self.tag_values = tag_values
+        self.emotes = emotes
+
+    @property
+    def tags(self):
+        """The IRC tags as a dictionary"""
+        return dict(zip(self.tag_keys, self.tag_values))
+
+    def to_record(self):
+        """Convert the message to a chat log record"""
+        record = {
+            "username": self.username,
+            "message": self.text,
+            "timestamp": self.timestamp
+        }
+        if self.tag_keys:
+            record["tags"] = self.tags
+        return record
+
+
+class MessageStore:
+    """Bounded in-memory store that keeps every chat message
+
+    Usernames, tag keys, emote names and low-cardinality tag values are
+    interned so repeated chatters and emotes share a single string. Once the
+    store holds more than ``max_messages`` records, unsaved records are
+    handed to the ``spill`` callback and the oldest records are evicted from
+    memory.
+    """
+
+    # Tags that are unique per message and therefore not worth interning
+    UNIQUE_TAGS = frozenset(("id", "client-nonce", "tmi-sent-ts", "reply-parent-msg-id",
+                             "reply-parent-msg-body", "reply-thread-parent-msg-id"))
+
+    def __init__(self, max_messages=None, spill=None):
+        """Initialize the message store"""
+        self.max_messages = max_messages or Config.MESSAGE_STORE_MAX_MESSAGES
+        self.spill = spill
+        self.records = []
+        self.saved = 0  # Number of leading records already written to disk
+        self.total_count = 0  # Messages added over the store's lifetime
+        self._strings = {}
+        self._tag_key_tuples = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def intern(self, value):
+        """Return the shared copy of a string"""
+        return self._strings.setdefault(value, value)
+
+    def add(self, username, text, timestamp, tags=None):
+        """Add a message to the store and return its record"""
+        tag_keys = ()
+        tag_values = ()
+        emotes = ()
+        if tags:
+            intern = self._strings.setdefault
+            unique_tags = self.UNIQUE_TAGS
+            tag_keys = tuple(tags)
+            tag_keys = self._tag_key_tuples.get(tag_keys) or self._tag_key_tuples.setdefault(
+                tag_keys, tuple([intern(key, key) for key in tag_keys]))
+            tag_values = tuple([
+                value if key in unique_tags else intern(value, value)
+                for key, value in tags.items()
+            ])
+            emotes = self._extract_emotes(text, tags.get("emotes"))
+
+        message = ChatMessage(self.intern(username), text, timestamp,
+                              tag_keys, tag_values, emotes)
+        self.records.append(message)
+        self.total_count += 1
+
+        if len(self.records) > self.max_messages:
+            self._evict()
+
+        return message
+
+    def _extract_emotes(self, text, emotes_tag):
+        """Extract interned emote names from a Twitch ``emotes`` tag
+
+        The tag looks like ``25:0-4,12-16/1902:6-10`` where the ranges are
+        inclusive code point offsets into the message text.
+        """
+        if not emotes_tag:
+            return ()
+
+        emotes = []
+        try:
+            for emote in emotes_tag.split("/"):
+                _, ranges = emote.split(":", 1)
+                for span in ranges.split(","):
+                    start, end = span.split("-", 1)
+                    emotes.append(self.intern(text[int(start):int(end) + 1]))
+        except ValueError:
+            logging.debug(f"Malformed emotes tag: {emotes_tag}")
+        return tuple(emotes)
+
+    def unsaved(self):
+        """Get the records that have not been written to disk yet"""
+        return self.records[self.saved:]
+
+    def mark_saved(self):
+        """Mark all current records as written to disk"""
+        self.saved = len(self.records)
+
+    def flush(self):
+        """Hand unsaved records to the spill callback"""
+        unsaved = self.unsaved()
+        if unsaved and self.spill:
+            self.spill([message.to_record() for message in unsaved])
+        self.mark_saved()
+        return len(unsaved)
+
+    def _evict(self):
+        """Drop the oldest quarter from memory, spilling unsaved records first"""
+        evicted = max(1, self.max_messages // 4)
+        if evicted > self.saved:
+            self.flush()
+        del self.records[:evicted]
+        self.saved -= evicted
+        logging.debug(f"Evicted {evicted} messages from the message store")
@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import sys
+import time
+from pathlib import Path
+
+import websockets
+
+# Add the root directory to the system path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from utils.utils import setup_logging, load_json, iter_chat_records
+
+setup_logging()
+
+SYNTHETIC_WORDS = ["LUL", "KEKW", "SAJ", "o7", "PauseChamp", "LOLL", "W", "true", "chat", "is",
+                   "this", "real", "no", "way", "GG", "Clap", "monkaS", "pog", "actually", "insane"]
+
+
+def load_replay_messages(logs_dir):
+    """Load (username, message) pairs from recorded chat logs"""
+    chat_logs = sorted(Path(logs_dir).rglob('*.json')) + sorted(Path(logs_dir).rglob('*.jsonl'))
+    messages = []
+    for file in chat_logs:
+        messages.extend(iter_chat_records(load_json(file)))
+    return messages
+
+
+def synthetic_messages(seed=0):
+    """Yield an endless stream of synthetic (username, message) pairs"""
+    rng = random.Random(seed)
+    while True:
+        words = rng.choices(SYNTHETIC_WORDS, k=rng.randint(1, 12))
+        yield f"chatter{rng.randrange(5000)}", " ".join(words)
+
+
+class ReplayServer:
+    """Local stand-in for Twitch IRC that replays chat at a fixed rate
+
+    Speaks enough of the protocol for TwitchChatReader: CAP, PASS, NICK,
+    USER, JOIN, PING and tagged PRIVMSGs. Every joined channel receives
+    ``rate`` messages per second for ``duration`` seconds, packed
+    ``lines_per_frame`` lines to a websocket frame.
+    """
+
+    def __init__(self, messages, rate=100, duration=30, lines_per_frame=1, ping_interval=60):
+        """Initialize the replay server"""
+        self.messages = messages
+        self.rate = rate
+        self.duration = duration
+        self.lines_per_frame = lines_per_frame
+        self.ping_interval = ping_interval
+        self.sequence = itertools.count()
+        self.streams = []
+        self.stats = {
+            "connections": 0,
+            "messages_sent": 0,
+            "frames_sent": 0,
+            "pings_sent": 0,
+            "pongs_received": 0,
+            "max_pong_latency": 0.0,
+            "max_send_behind": 0.0  # Seconds the server itself fell behind schedule
+        }
+
+    def build_line(self, channel, username, text):
+        """Build a tagged PRIVMSG line like the ones Twitch sends"""
+        login = username.lower()
+        sequence = next(self.sequence)
+        tags = (
+            f"@badge-info=;badges=;color=#1E90FF;display-name={username};emotes=;"
+            f"first-msg=0;flags=;id={sequence};mod=0;room-id=1;subscriber=0;"
+            f"tmi-sent-ts={int(time.time() * 1000)};turbo=0;user-id=1;user-type="
+        )
+        return f"{tags} :{login}!{login}@{login}.tmi.twitch.tv PRIVMSG #{channel} :{text}\r\n"
+
+    async def handler(self, websocket):
+        """Handle a single client connection"""
+        self.stats["connections"] += 1
+        nickname = "justinfan"
+        ping_sent_at = None
+
+        async def send_ping():
+            nonlocal ping_sent_at
+            while True:
+                await asyncio.sleep(self.ping_interval)
+                ping_sent_at = time.monotonic()
+                self.stats["pings_sent"] += 1
+                await websocket.send("PING :tmi.twitch.tv\r\n")
+
+        pinger = asyncio.create_task(send_ping())
+        try:
+            async for frame in websocket:
+                for line in frame.split("\r\n"):
+                    command, _, rest = line.partition(" ")
+                    if command == "CAP":
+                        await websocket.send(f":tmi.twitch.tv CAP * ACK :{rest.partition(':')[2]}\r\n")
+                    elif command == "NICK":
+                        nickname = rest
+                        await websocket.send(f":tmi.twitch.tv 001 {nickname} :Welcome, GLHF!\r\n")
+                    elif command == "JOIN":
+                        channel = rest.lstrip("#")
+                        await websocket.send(
+                            f":{nickname}!{nickname}@{nickname}.tmi.twitch.tv JOIN #{channel}\r\n")
+                        self.streams.append(asyncio.create_task(self.stream(websocket, channel)))
+                    elif command == "PONG" and ping_sent_at is not None:
+                        self.stats["pongs_received"] += 1
+                        latency = time.monotonic() - ping_sent_at
+                        self.stats["max_pong_latency"] = max(self.stats["max_pong_latency"], latency)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            pinger.cancel()
+
+    async def stream(self, websocket, channel):
+        """Send chat to a channel at the configured rate"""
+        if isinstance(self.messages, list):
+            source = itertools.cycle(self.messages)
+        else:
+            source = self.messages
+
+        interval = self.lines_per_frame / self.rate
+        start = time.monotonic()
+        frames = 0
+        try:
+            while time.monotonic() - start < self.duration:
+                lines = [self.build_line(channel, *next(source)) for _ in range(self.lines_per_frame)]
+                await websocket.send("".join(lines))
+                self.stats["messages_sent"] += len(lines)
+                self.stats["frames_sent"] += 1
+                frames += 1
+
+                # Schedule against the start time so sleeps do not drift
+                delay = start + frames * interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    self.stats["max_send_behind"] = max(self.stats["max_send_behind"], -delay)
+                    if frames % 100 == 0:
+                        await asyncio.sleep(0)
+        except websockets.exceptions.ConnectionClosed:
+            logging.warning(f"Client disconnected while streaming #{channel}")
+
+    async def serve(self, host, port):
+        """Serve until every stream has finished"""
+        async with websockets.serve(self.handler, host, port, max_queue=None):
+            logging.info(f"Replay server listening on ws://{host}:{port}")
+            while not self.streams:
+                await asyncio.sleep(0.1)
+
+            # Wait for late joins, then for every stream to finish
+            while not all(stream.done() for stream in self.streams):
+                await asyncio.sleep(0.1)
+
+
+async def main():
+    parser = argparse.ArgumentParser(
+        description="Replay recorded or synthetic chat over a local Twitch IRC stand-in.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=6667)
+    parser.add_argument("--rate", type=float, default=100,
+                        help="Messages per second sent to each joined channel.")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="Seconds to stream to each joined channel.")
+    parser.add_argument("--lines-per-frame", type=int, default=1,
+                        help="PRIVMSG lines packed into each websocket frame.")
+    parser.add_argument("--ping-interval", type=float, default=60,
+                        help="Seconds between PINGs sent to each client.")
+    parser.add_argument("--source", choices=["logs", "synthetic"], default="logs")
+    parser.add_argument("--logs", default="data/chat_logs",
+                        help="Chat log directory to replay when --source=logs.")
+    args = parser.parse_args()
+
+    if args.source == "logs":
+        messages = load_replay_messages(args.logs)
+        logging.info(f"Replaying {len(messages)} recorded messages")
+    else:
+        messages = synthetic_messages()
+
+    server = ReplayServer(messages, rate=args.rate, duration=args.duration,
+                          lines_per_frame=args.lines_per_frame, ping_interval=args.ping_interval)
+    await server.serve(args.host, args.port)
+
+    # Print the final stats as JSON for the load test to pick up
+    print(json.dumps(server.stats), flush=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,11 +1,12 @@
 import asyncio
 import logging
 import os
+import sys
 from typing import Coroutine
 
 from config.config import Config
 from utils.dataset_formatter import format_dataset
-from twitch.chat_reader import TwitchChatReader
+from twitch.chat_reader_pool import ChatReaderPool
 from utils.utils import setup_logging, get_timestamp
 
 # Create logs directory for the live stream detector
@@ -27,16 +28,21 @@ logger.addHandler(file_handler)
 class AutoChatRecorder:
     """Class to record Twitch chat logs"""
 
-    def __init__(self, channel=None):
+    def __init__(self, channel=None, channels=None):
         """Initialize the chat recorder"""
-        self.channel = channel or Config.TWITCH_CHANNEL
+        self.channels = channels or ([channel] if channel else Config.TWITCH_CHANNELS)
+        self.channel = self.channels[0] if self.channels else None
         self.chat_reader = None
 
     async def start(self):
-        """Start recording chat"""
-        logger.info(f"Starting chat recording for channel '{self.channel}'")
+        """Start recording chat, returning False if there is no channel to record"""
+        if not self.channels:
+            logger.error("No channels to record, set CHANNEL or CHANNELS in the .env file")
+            return False
 
-        self.chat_reader = TwitchChatReader(channel=self.channel)
+        logger.info(f"Starting chat recording for channel(s) {', '.join(self.channels)}")
+
+        self.chat_reader = ChatReaderPool(channels=self.channels)
 
         try:
             await self.chat_reader.start()
@@ -57,12 +63,14 @@ class AutoChatRecorder:
                 except Exception as e:
                     logger.error(f"Error formatting dataset: {e}")
                     raise  # Re-raise to ensure we see the full error
+        return True
 
 
 async def main():
     """Main function to run the chat recorder"""
-    recorder = AutoChatRecorder(channel=Config.TWITCH_CHANNEL)
-    await recorder.start()
+    recorder = AutoChatRecorder(channels=Config.TWITCH_CHANNELS)
+    if not await recorder.start():
+        sys.exit(1)
 
 
 if __name__ == "__main__":
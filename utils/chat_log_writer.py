@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import time
+
+from config.config import Config
+
+FSYNC_POLICIES = ("always", "rotate", "never")
+
+
+class ChatLogWriter:
+    """Append-only writer for newline-delimited chat log segments
+
+    Records are appended to ``<base_path>_<index>.jsonl.part`` and the segment
+    is renamed to ``<base_path>_<index>.jsonl`` once it is rotated or closed,
+    so a finished ``.jsonl`` file is always complete. Each flush only costs the
+    size of the batch being written.
+    """
+
+    def __init__(self, base_path, max_segment_bytes=None, max_segment_seconds=None, fsync_policy=None):
+        """Initialize the chat log writer"""
+        self.base_path = str(base_path)
+        self.max_segment_bytes = max_segment_bytes or Config.CHAT_LOG_SEGMENT_MAX_BYTES
+        self.max_segment_seconds = max_segment_seconds or Config.CHAT_LOG_SEGMENT_MAX_SECONDS
+        self.fsync_policy = fsync_policy or Config.CHAT_LOG_FSYNC
+
+        if self.fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(
+                f"Invalid fsync policy '{self.fsync_policy}', expected one of {FSYNC_POLICIES}")
+
+        self.segment_index = 0
+        self.segment_file = None
+        self.segment_path = None
+        self.segment_bytes = 0
+        self.segment_opened_at = None
+        self.segments = []  # Finalized segment paths
+
+        directory = os.path.dirname(self.base_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _open_segment(self):
+        """Open a new in-progress segment"""
+        self.segment_path = f"{self.base_path}_{self.segment_index:04d}.jsonl"
+        self.segment_file = open(f"{self.segment_path}.part", 'a', encoding='utf-8')
+        self.segment_bytes = 0
+        self.segment_opened_at = time.monotonic()
+
+    def _close_segment(self):
+        """Finalize the in-progress segment by renaming it into place"""
+        if not self.segment_file:
+            return
+
+        self.segment_file.flush()
+        if self.fsync_policy != "never":
+            os.fsync(self.segment_file.fileno())
+        self.segment_file.close()
+
+        os.replace(f"{self.segment_path}.part", self.segment_path)
+        if self.fsync_policy != "never":
+            self._fsync_directory()
+
+        logging.info(f"Finalized chat log segment {self.segment_path}")
+        self.segments.append(self.segment_path)
+        self.segment_file = None
+        self.segment_index += 1
+
+    def _fsync_directory(self):
+        """Persist the rename of a segment (not supported on Windows)"""
+        if os.name != "posix":
+            return
+        fd = os.open(os.path.dirname(self.segment_path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _should_rotate(self):
+        """Check whether the in-progress segment is due for rotation"""
+        if self.segment_bytes >= self.max_segment_bytes:
+            return True
+        return time.monotonic() - self.segment_opened_at >= self.max_segment_seconds
+
+    def write_records(self, records):
+        """Append a batch of records and return the number written"""
+        if not records:
+            return 0
+
+        if not self.segment_file:
+            self._open_segment()
+
+        data = ''.join(
+            json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+            for record in records
+        )
+        self.segment_file.write(data)
+        self.segment_file.flush()
+        if self.fsync_policy == "always":
+            os.fsync(self.segment_file.fileno())
+
+        self.segment_bytes += len(data.encode('utf-8'))
+        if self._should_rotate():
+            self._close_segment()
+
+        return len(records)
+
+    def close(self):
+        """Finalize the in-progress segment"""
+        self._close_segment()
@@ -1,19 +1,32 @@
+import hashlib
+import json
 import logging
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from utils.utils import load_json, save_json
+import numpy as np
+from config.config import Config
+from utils.utils import load_json, save_json, iter_chat_records
 import re
 
 
-def clean_message(message):
-    # Remove URLs
-    message = re.sub(
-        r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', '', message)
+# Everything clean_message removes, fused into a single precompiled pattern:
+# - URLs. The character class is the original
+#   (?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|%XX) collapsed, since the
+#   $-_ range already covers digits, upper case letters and most punctuation
+# - Unicode escape sequences like \ud83e\udd75
+# - Any remaining backslash sequences
+CLEAN_PATTERN = re.compile(
+    r'https?://[!$-_a-z]+'
+    r'|\\u[0-9a-fA-F]{4}(?:\\u[0-9a-fA-F]{4})?'
+    r'|\\[a-zA-Z0-9]{2,}'
+)
 
-    # Remove Unicode escape sequences like \ud83e\udd75
-    message = re.sub(r'\\u[0-9a-fA-F]{4}(?:\\u[0-9a-fA-F]{4})?', '', message)
 
-    # Remove any remaining backslash sequences
-    message = re.sub(r'\\[a-zA-Z0-9]{2,}', '', message)
+def clean_message(message):
+    # Remove URLs, Unicode escape sequences and backslash sequences in one pass
+    message = CLEAN_PATTERN.sub('', message)
 
     # Strip extra whitespace
     message = message.strip()
@@ -21,52 +34,420 @@ def clean_message(message):
     # If after cleaning the message is empty, return None
     return message if message else None
 
+
+def collapse_repetition(message, max_repeats=None, max_phrase_length=8):
+    """Collapse a phrase repeated back to back to at most max_repeats copies
+
+    "slayyy GIRLS NIGHT RAID slayyy GIRLS NIGHT RAID slayyy GIRLS NIGHT RAID"
+    becomes "slayyy GIRLS NIGHT RAID slayyy GIRLS NIGHT RAID" with the default
+    of two repeats. Phrases of up to max_phrase_length words are considered.
+    """
+    max_repeats = max_repeats or Config.DEDUP_MAX_REPEATS
+    tokens = message.split()
+    if len(tokens) <= max_repeats:
+        return message
+
+    changed = False
+    for size in range(1, min(max_phrase_length, len(tokens) // 2) + 1):
+        collapsed = []
+        i = 0
+        while i < len(tokens):
+            phrase = tokens[i:i + size]
+            repeats = 1
+            while tokens[i + repeats * size:i + (repeats + 1) * size] == phrase:
+                repeats += 1
+
+            if repeats > max_repeats:
+                collapsed.extend(phrase * max_repeats)
+                i += repeats * size
+                changed = True
+            else:
+                collapsed.append(tokens[i])
+                i += 1
+        tokens = collapsed
+
+    return " ".join(tokens) if changed else message
+
+
+def stable_hash(text):
+    """64-bit hash that is stable across processes, unlike hash()"""
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def simhash(text, shingle_size=4):
+    """64-bit SimHash of a text's character shingles"""
+    shingles = {text[i:i + shingle_size] for i in range(max(1, len(text) - shingle_size + 1))}
+    bit_strings = [format(stable_hash(shingle), '064b') for shingle in shingles]
+
+    # Each bit is set if it is set in the majority of the shingle hashes
+    threshold = len(bit_strings) / 2
+    bits = ''.join('1' if column.count('1') > threshold else '0' for column in zip(*bit_strings))
+    return int(bits, 2)
+
+
+class MessageDeduplicator:
+    """Suppress copypasta, repeated spam and near-duplicate messages
+
+    Each message goes through three stages:
+    1. Back to back repetition inside the message is collapsed.
+    2. Exact duplicates (ignoring case and whitespace) are capped at
+       max_copies occurrences across the whole dataset.
+    3. Messages of at least near_min_chars characters are matched against a
+       SimHash index, and near-duplicates within max_distance bits of an
+       earlier message are capped at max_near_copies occurrences.
+
+    The SimHash index is split into bands so that any two hashes within
+    max_distance bits share at least one band and lookups stay cheap.
+
+    Only the counts that still matter are carried over to the next run:
+    hashes that reached their cap, so they stay capped, and the ``recent``
+    most recently seen ones, so repeats across runs are still counted. The
+    state therefore stays bounded as the dataset grows.
+    """
+
+    def __init__(self, max_copies=None, max_near_copies=None, max_distance=None,
+                 near_min_chars=None, recent=None, state=None):
+        """Initialize the deduplicator, optionally from a saved state"""
+        self.max_copies = max_copies or Config.DEDUP_MAX_COPIES
+        self.max_near_copies = max_near_copies or Config.DEDUP_MAX_NEAR_COPIES
+        self.max_distance = max_distance or Config.DEDUP_SIMHASH_DISTANCE
+        self.near_min_chars = near_min_chars or Config.DEDUP_NEAR_MIN_CHARS
+        self.recent = recent or Config.DEDUP_STATE_RECENT
+
+        self.bands = self.max_distance + 1
+        self.band_bits = 64 // self.bands
+        self.band_mask = (1 << self.band_bits) - 1
+
+        state = state or {}
+        self.exact_counts = {int(key): count for key, count in state.get("exact", {}).items()}
+        self.near_hashes = []
+        self.near_counts = []
+        self.index = [{} for _ in range(self.bands)]
+        for fingerprint, count in state.get("near", []):
+            self._add_near(fingerprint, count)
+
+        self.stats = {
+            "messages_in": 0,
+            "messages_out": 0,
+            "exact_duplicates": 0,
+            "near_duplicates": 0,
+            "repetitions_collapsed": 0,
+            "tokens_in": 0,
+            "tokens_out": 0
+        }
+
+    def _add_near(self, fingerprint, count):
+        """Add a SimHash to the index"""
+        position = len(self.near_hashes)
+        self.near_hashes.append(fingerprint)
+        self.near_counts.append(count)
+        for band in range(self.bands):
+            key = (fingerprint >> (band * self.band_bits)) & self.band_mask
+            self.index[band].setdefault(key, []).append(position)
+
+    def _find_near(self, fingerprint):
+        """Find an indexed SimHash within max_distance bits"""
+        for band in range(self.bands):
+            key = (fingerprint >> (band * self.band_bits)) & self.band_mask
+            for position in self.index[band].get(key, ()):
+                if bin(self.near_hashes[position] ^ fingerprint).count('1') <= self.max_distance:
+                    return position
+        return None
+
+    def process(self, message):
+        """Return the message to keep, or None if it should be dropped"""
+        tokens_in = len(message.split())
+        self.stats["messages_in"] += 1
+        self.stats["tokens_in"] += tokens_in
+
+        collapsed = collapse_repetition(message)
+        if collapsed is not message:
+            self.stats["repetitions_collapsed"] += 1
+            message = collapsed
+
+        normalized = ' '.join(message.casefold().split())
+        key = stable_hash(normalized)
+        count = self.exact_counts.get(key, 0) + 1
+        self.exact_counts[key] = count
+        if count > self.max_copies:
+            self.stats["exact_duplicates"] += 1
+            return None
+
+        if len(normalized) >= self.near_min_chars:
+            fingerprint = simhash(normalized)
+            position = self._find_near(fingerprint)
+            if position is None:
+                self._add_near(fingerprint, 1)
+            else:
+                self.near_counts[position] += 1
+                if self.near_counts[position] > self.max_near_copies:
+                    self.stats["near_duplicates"] += 1
+                    return None
+
+        self.stats["messages_out"] += 1
+        self.stats["tokens_out"] += len(message.split())
+        return message
+
+    def filter(self, messages):
+        """Yield the messages that survive deduplication"""
+        for message in messages:
+            message = self.process(message)
+            if message is not None:
+                yield message
+
+    def state(self):
+        """The capped and recent counts, oldest first, to carry over to the next run"""
+        exact_start = len(self.exact_counts) - self.recent
+        exact = {key: count for i, (key, count) in enumerate(self.exact_counts.items())
+                 if i >= exact_start or count >= self.max_copies}
+        near_start = len(self.near_hashes) - self.recent
+        near = [(fingerprint, count) for i, (fingerprint, count) in enumerate(zip(self.near_hashes, self.near_counts))
+                if i >= near_start or count >= self.max_near_copies]
+        return {"exact": exact, "near": near}
+
+    def log_summary(self):
+        """Log how much the deduplicator removed"""
+        stats = self.stats
+        removed = stats["tokens_in"] - stats["tokens_out"]
+        share = removed / stats["tokens_in"] if stats["tokens_in"] else 0.0
+        logging.info(
+            f"Deduplication kept {stats['messages_out']} of {stats['messages_in']} messages: "
+            f"{stats['exact_duplicates']} exact duplicates, {stats['near_duplicates']} near-duplicates "
+            f"dropped, {stats['repetitions_collapsed']} repetitive messages collapsed. "
+            f"Removed {removed} of {stats['tokens_in']} whitespace tokens ({share:.1%})")
+
+
+def save_dedup_state(state, path):
+    """Save a deduplicator state as compact binary arrays"""
+    partial_path = f"{path}.part"
+    with open(partial_path, 'wb') as f:
+        np.savez(f,
+                 exact_keys=np.fromiter(state["exact"].keys(), dtype=np.uint64, count=len(state["exact"])),
+                 exact_counts=np.fromiter(state["exact"].values(), dtype=np.uint32, count=len(state["exact"])),
+                 near_hashes=np.array([fingerprint for fingerprint, _ in state["near"]], dtype=np.uint64),
+                 near_counts=np.array([count for _, count in state["near"]], dtype=np.uint32))
+    os.replace(partial_path, path)
+
+
+def load_dedup_state(path):
+    """Load a deduplicator state, or the JSON state of older versions next to it"""
+    if Path(path).exists():
+        with np.load(path) as arrays:
+            return {
+                "exact": dict(zip(arrays["exact_keys"].tolist(), arrays["exact_counts"].tolist())),
+                "near": list(zip(arrays["near_hashes"].tolist(), arrays["near_counts"].tolist()))
+            }
+    legacy_path = Path(path).with_suffix('.json')
+    if legacy_path.exists():
+        return load_json(legacy_path)
+    return None
+
+
 # Load in the chat logs and format them into a dataset, removing the username and just leaving the message
 # Example: "david_kapp": "LUL LUL LUL"
 # Becomes: "LUL LUL LUL"
 
 
-def format_dataset():
-    # Read in all JSONs in the chat_logs directory
-    messages = {}
-    for file in Path('data/chat_logs').rglob('*.json'):
-        try:
-            data = load_json(file)
-            messages.update(data)  # Fixed the line break here
-        except Exception as e:
-            logging.error(f"Failed to load {file}: {str(e)}")
+def file_fingerprint(file):
+    """Get the size, modification time and content hash of a chat log"""
+    stat = os.stat(file)
+    digest = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": digest.hexdigest()}
+
+
+def find_new_chat_logs(manifest):
+    """Find chat logs that are not in the manifest or changed since ingestion
+
+    Files whose size and mtime match the manifest are skipped without being
+    read, others are hashed so that a touched but unchanged file is skipped
+    as well. Returns the files to process and their new fingerprints.
+    """
+    chat_logs = sorted(Path(Config.CHAT_LOGS_DIR).rglob('*.json')) + \
+        sorted(Path(Config.CHAT_LOGS_DIR).rglob('*.jsonl'))
+
+    new_logs = []
+    for file in chat_logs:
+        entry = manifest.get(str(file))
+        stat = os.stat(file)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
             continue
 
-    logging.info(f"Loaded {len(messages)} messages")
+        fingerprint = file_fingerprint(file)
+        if entry and entry["sha256"] == fingerprint["sha256"]:
+            manifest[str(file)] = fingerprint
+            continue
 
-    formatted_data = []
+        if entry:
+            logging.warning(
+                f"{file} changed since it was ingested, its messages will be added again. "
+                f"Use --rebuild to regenerate the dataset without duplicates.")
+        new_logs.append((file, fingerprint))
 
-    # messages is a dictionary where keys are usernames and values are dictionaries with 'message' and 'timestamp'
-    for username, message_data in messages.items():
-        try:
-            # Extract the message text
-            if isinstance(message_data, str):
-                # Handle case where message is directly stored as string
-                message = message_data
-            else:
-                # Handle case where message is in a dictionary
-                message = message_data['message']
+    return new_logs
+
+
+def clean_chat_log(file):
+    """Load and clean a single chat log, returning its cleaned messages
+
+    Runs in the worker processes of format_dataset, so it returns None
+    instead of raising when the log cannot be loaded.
+    """
+    try:
+        data = load_json(file)
+        if data is None:
+            # load_json logs the error, the log stays out of the manifest
+            # so it is retried once fixed
+            return None
+        return list(iter_cleaned_messages(iter_chat_records(data)))
+    except Exception as e:
+        logging.error(f"Failed to load {file}: {str(e)}")
+        return None
+
+
+def imap_ordered(executor, func, items, window):
+    """Like executor.map, but with at most ``window`` results pending
+
+    Results are yielded in submission order while keeping memory bounded to
+    a few files worth of messages.
+    """
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def iter_chat_logs(new_logs, manifest, workers=None):
+    """Yield the cleaned messages of each new chat log, in order
+
+    Logs are cleaned in parallel across a process pool and merged back in
+    their original order. A log is only recorded in the manifest once all
+    of its messages have been yielded.
+    """
+    workers = workers or Config.FORMATTER_WORKERS
+    files = [file for file, _ in new_logs]
 
+    if workers > 1 and len(files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = imap_ordered(executor, clean_chat_log, files, window=workers * 2)
+            for (file, fingerprint), messages in zip(new_logs, results):
+                if messages is not None:
+                    yield from messages
+                    manifest[str(file)] = fingerprint
+    else:
+        for file, fingerprint in new_logs:
+            messages = clean_chat_log(file)
+            if messages is not None:
+                yield from messages
+                manifest[str(file)] = fingerprint
+
+
+def iter_cleaned_messages(messages):
+    """Yield the non-empty cleaned text of each message"""
+    for username, message in messages:
+        try:
             cleaned_message = clean_message(message)
             if cleaned_message:  # Only add non-empty messages
-                formatted_data.append(cleaned_message)
+                yield cleaned_message
         except Exception as e:
             logging.error(
                 f"Error processing message from {username}: {str(e)}")
             continue
 
-    # Save the formatted data to a JSON file, if the file already exists, append to it
-    if Path('data/formatted_logs/dataset.json').exists():
-        existing_data = load_json('data/formatted_logs/dataset.json')
-        existing_data.extend(formatted_data)
-        save_json(existing_data, 'data/formatted_logs/dataset.json')
+
+def append_dataset(messages, path):
+    """Append messages to a newline-delimited dataset, one {"text": ...} per line
+
+    If writing fails part way, the file is truncated back to its original
+    size so a retry does not leave partial or duplicated rows behind.
+    """
+    with open(path, 'a', encoding='utf-8') as f:
+        original_size = f.tell()
+        count = 0
+        try:
+            for message in messages:
+                f.write(json.dumps({"text": message}, ensure_ascii=False) + '\n')
+                count += 1
+        except BaseException:
+            f.flush()
+            f.truncate(original_size)
+            raise
+    return count
+
+
+def migrate_legacy_dataset():
+    """Convert a legacy dataset.json list into the newline-delimited dataset"""
+    if Path(Config.DATASET_PATH).exists() or not Path(Config.LEGACY_DATASET_PATH).exists():
+        return
+
+    logging.info(
+        f"Converting {Config.LEGACY_DATASET_PATH} to {Config.DATASET_PATH}")
+    legacy_data = load_json(Config.LEGACY_DATASET_PATH) or []
+    partial_path = f"{Config.DATASET_PATH}.part"
+    if Path(partial_path).exists():
+        os.remove(partial_path)
+    append_dataset(legacy_data, partial_path)
+    os.replace(partial_path, Config.DATASET_PATH)
+
+
+def format_dataset(rebuild=False):
+    # Only process chat logs that were added or changed since the last run,
+    # unless rebuilding the dataset from scratch
+    manifest = {}
+    if not rebuild and Path(Config.DATASET_MANIFEST_PATH).exists():
+        manifest = load_json(Config.DATASET_MANIFEST_PATH) or {}
+    new_logs = find_new_chat_logs(manifest)
+    logging.info(f"Found {len(new_logs)} new or changed chat logs")
+
+    os.makedirs(os.path.dirname(Config.DATASET_PATH), exist_ok=True)
+    if not rebuild:
+        migrate_legacy_dataset()
+
+        # A dataset without a manifest was built by an older version from the
+        # logs already present, so record them as ingested instead of adding
+        # their messages a second time
+        if not Path(Config.DATASET_MANIFEST_PATH).exists() and Path(Config.DATASET_PATH).exists():
+            for file, fingerprint in new_logs:
+                manifest[str(file)] = fingerprint
+            save_json(manifest, Config.DATASET_MANIFEST_PATH)
+            logging.warning(
+                f"No manifest found for {Config.DATASET_PATH}, recorded {len(new_logs)} chat logs as already "
+                f"ingested without adding them. Use --rebuild to regenerate the dataset from all chat logs.")
+            return
+
+    # Deduplication caps apply across runs, so carry the previous state over
+    dedup_state = None if rebuild else load_dedup_state(Config.DEDUP_STATE_PATH)
+    deduplicator = MessageDeduplicator(state=dedup_state)
+
+    # Stream the new chat logs, both the legacy username -> message JSON
+    # files and the newline-delimited segments, through cleaning and
+    # deduplication straight into the dataset file
+    messages = iter_chat_logs(new_logs, manifest)
+    if Config.DEDUP_ENABLED:
+        messages = deduplicator.filter(messages)
+
+    if rebuild:
+        # Build the new dataset next to the old one and swap it in at the end
+        partial_path = f"{Config.DATASET_PATH}.part"
+        if Path(partial_path).exists():
+            os.remove(partial_path)
+        count = append_dataset(messages, partial_path)
+        os.replace(partial_path, Config.DATASET_PATH)
     else:
-        save_json(formatted_data, 'data/formatted_logs/dataset.json')
+        count = append_dataset(messages, Config.DATASET_PATH)
+
+    logging.info(f"Added {count} messages to {Config.DATASET_PATH}")
+    if Config.DEDUP_ENABLED:
+        deduplicator.log_summary()
+        save_dedup_state(deduplicator.state(), Config.DEDUP_STATE_PATH)
+
+    # Only record the logs as ingested once their messages are saved
+    save_json(manifest, Config.DATASET_MANIFEST_PATH)
 
 
 if __name__ == '__main__':
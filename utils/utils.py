@@ -34,9 +34,53 @@ def save_json(data, filename):
 
 
 def load_json(filename):
+    if str(filename).endswith(('.jsonl', '.jsonl.part')):
+        return load_jsonl(filename)
+
     try:
         with open(filename, 'r') as f:
             return json.load(f)
     except Exception as e:
         logging.error(f'Error loading {filename}: {e}')
         return None
+
+
+def iter_jsonl(filename):
+    """Lazily yield newline-delimited JSON records, skipping truncated lines"""
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(
+                    f'Skipping malformed line {line_number} in {filename}')
+
+
+def load_jsonl(filename):
+    """Load newline-delimited JSON records, skipping truncated lines"""
+    try:
+        return list(iter_jsonl(filename))
+    except Exception as e:
+        logging.error(f'Error loading {filename}: {e}')
+        return None
+
+
+def iter_chat_records(data):
+    """Yield (username, message) pairs from a segment or legacy chat log
+
+    Segments are lists of {"username": ..., "message": ...} records, legacy
+    chat logs map usernames to either a message string or a dictionary with
+    a 'message' key.
+    """
+    if isinstance(data, dict):
+        for username, message_data in data.items():
+            if isinstance(message_data, str):
+                yield username, message_data
+            else:
+                yield username, message_data['message']
+    elif data:
+        for record in data:
+            yield record.get('username'), record['message']